@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+import argparse, sys
+
+parser = argparse.ArgumentParser(description='Answer a large file of utterances or dialogs offline, models are loaded once and shared by worker processes')
+parser.add_argument('-c', '--config', dest='config', help='yaml configuration file')
+parser.add_argument('-i', '--input', dest='input', help='input file, text with one utterance per line, or json lines of {"id", "turns"}')
+parser.add_argument('-o', '--output', dest='output', help='output json lines of {"id", "turn", "text", "response", "score", "topic"}, same order as input, failed queries have an extra "error"')
+parser.add_argument('--multi-turn', dest='multi_turn', action='store_true', help='for text input, utterances separated by blank lines are turns of one dialog')
+parser.add_argument('--workers', dest='workers', type=int, default=1, help='worker processes, default is 1')
+parser.add_argument('--batch-size', dest='batch_size', type=int, default=64, help='queries of each batch, default is 64')
+parser.add_argument('--concurrency', dest='concurrency', type=int, default=None, help='batches answered concurrently, default is 2 per worker')
+parser.add_argument('--log', dest='log', action='store_true', help='keep chat log of log_db in config, default is off')
+
+args = parser.parse_args()
+
+if len(sys.argv) < 2:
+    parser.print_help()
+    parser.exit()
+
+import json, time
+from nlptools.utils import Config
+from elsabot.module.interact_session import InteractSession
+from elsabot.module.worker_pool import WorkerPool
+from elsabot.module.bulk import read_dialogs, answer
+
+cfg = Config(args.config)
+if not args.log and "model_general" in cfg:
+    cfg.model_general.pop("log_db", None)
+concurrency = args.concurrency or 2 * args.workers
+
+session = InteractSession.build(cfg)
+if args.workers > 1:
+    session = WorkerPool(session, workers=args.workers, worker_threads=concurrency)
+
+start_time, n, errors = time.time(), 0, 0
+with open(args.output, "w") as f:
+    for result in answer(session, read_dialogs(args.input, multi_turn=args.multi_turn),
+                         batch_size=args.batch_size, concurrency=concurrency):
+        f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        n += 1
+        errors += "error" in result
+session.close()
+print("answered {} queries in {:.1f} seconds, {} failed, saved to {}".format(n, time.time() - start_time, errors, args.output))
@@ -4,6 +4,11 @@ import argparse, sys
 parser = argparse.ArgumentParser(description='Interact session')
 parser.add_argument('-c', '--config', dest='config', help='yaml configuration file')
 parser.add_argument('-t', '--text', dest='text', default=None, help='query text')
+parser.add_argument('--record', dest='record', default=None, help='record queries to file for replay benchmark')
+parser.add_argument('--replay', dest='replay', default=None, help='replay recorded queries and report latency, throughput and memory')
+parser.add_argument('--speed', dest='speed', type=float, default=1., help='replay speed factor, 0 to replay as fast as possible, default is 1')
+parser.add_argument('--concurrency', dest='concurrency', type=int, default=16, help='maximum concurrent queries of replay, default is 16')
+parser.add_argument('--report', dest='report', default=None, help='save replay report to json file')
 
 args = parser.parse_args()
 
@@ -16,11 +21,23 @@ from nlptools.utils import Config
 
 cfg = Config(args.config)
 
-backend = Backend(args.config, **cfg.backend)
+if args.replay is not None:
+    import json
+    from elsabot.backend.backend import BackendBase
+    from elsabot.module.benchmark import TrafficRecorder, replay
+    # replayed queries are not recorded again
+    session = BackendBase(args.config, record_traffic=False).session
+    report = replay(session, TrafficRecorder.load(args.replay), speed=args.speed, concurrency=args.concurrency)
+    print(json.dumps(report, indent=2))
+    if args.report is not None:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    sys.exit()
+
+backend = Backend(args.config, record_traffic=args.record, **cfg.backend)
 
 if args.text is not None:
     backend.query(args.text)
 else:
     backend.run()
 
-
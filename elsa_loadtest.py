@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+import argparse, sys
+
+parser = argparse.ArgumentParser(description='Load test of rest backend, rest skills are served by a local stand-in server')
+parser.add_argument('-c', '--config', dest='config', help='yaml configuration file')
+parser.add_argument('--backend', dest='backend', default='restful_async', help='restful or restful_async, default is restful_async')
+parser.add_argument('--port', dest='port', type=int, default=5100, help='port of backend, default is 5100')
+parser.add_argument('--levels', dest='levels', default='1,2,4,8,16,32,64', help='comma separated concurrency levels, default is 1,2,4,8,16,32,64')
+parser.add_argument('--duration', dest='duration', type=float, default=10, help='seconds of each level, default is 10')
+parser.add_argument('--turns', dest='turns', type=int, default=5, help='queries of each synthetic session, default is 5')
+parser.add_argument('--texts', dest='texts', default=None, help='file of query texts, one per line')
+parser.add_argument('--latency', dest='latency', type=float, default=0.05, help='mean seconds of stand-in rest latency, default is 0.05')
+parser.add_argument('--latency-std', dest='latency_std', type=float, default=0.02, help='standard deviation of stand-in latency, default is 0.02')
+parser.add_argument('--latency-dist', dest='latency_dist', default='normal', help='normal, exponential or fixed, default is normal')
+parser.add_argument('--error-rate', dest='error_rate', type=float, default=0., help='ratio of stand-in errors, default is 0')
+parser.add_argument('--report', dest='report', default=None, help='save report to json file')
+
+args = parser.parse_args()
+
+if len(sys.argv) < 2:
+    parser.print_help()
+    parser.exit()
+
+import json
+from nlptools.utils import Config
+from elsabot.module.loadtest import StandInServer, patch_rest_skills, start_backend, sweep
+
+cfg = Config(args.config)
+
+stand_in = StandInServer(latency=args.latency, latency_std=args.latency_std,
+                         latency_dist=args.latency_dist, error_rate=args.error_rate).start()
+session_config = patch_rest_skills(cfg, stand_in.url)
+
+backend_config = {"backend_type": args.backend, "url_rule": "/api/query", "methods": ["POST"], "port": args.port}
+backend = start_backend(session_config, backend_config)
+
+texts = None
+if args.texts is not None:
+    with open(args.texts) as f:
+        texts = [l.strip() for l in f if l.strip()]
+
+levels = [int(l) for l in args.levels.split(",")]
+report = sweep("http://127.0.0.1:{}/api/query".format(args.port), levels=levels,
+               duration=args.duration, turns=args.turns, texts=texts)
+report["stand_in"] = stand_in.stats
+print(json.dumps(report, indent=2))
+if args.report is not None:
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+
+backend.terminate()
+stand_in.stop()
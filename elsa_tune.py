@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+import argparse, sys, os
+
+parser = argparse.ArgumentParser(description='Tune torch threads, workers and batch size for this machine, write a profile used by tune_profile in config')
+parser.add_argument('-c', '--config', dest='config', help='yaml configuration file')
+parser.add_argument('-o', '--output', dest='output', default=None, help='profile file, default is tune_profile in config or elsa_profile.json')
+parser.add_argument('--threads', dest='threads', default=None, help='comma separated torch threads, default is 1,2,4,... up to cpu count')
+parser.add_argument('--interop', dest='interop', default='1', help='comma separated torch inter-op threads, default is 1')
+parser.add_argument('--workers', dest='workers', default=None, help='comma separated worker counts, default is 1,2,4,... up to cpu count')
+parser.add_argument('--batch-sizes', dest='batch_sizes', default='1,4,16', help='comma separated micro batch sizes, default is 1,4,16')
+parser.add_argument('--duration', dest='duration', type=float, default=5, help='seconds of each trial, default is 5')
+parser.add_argument('--latency-budget', dest='latency_budget', type=float, default=0.5, help='seconds of p95 latency budget, default is 0.5')
+
+args = parser.parse_args()
+
+if len(sys.argv) < 2:
+    parser.print_help()
+    parser.exit()
+
+import json
+from nlptools.utils import Config
+from elsabot.module.interact_session import InteractSession
+from elsabot.module.autotune import tune
+
+cfg = Config(args.config)
+output = args.output or (cfg.tune_profile if "tune_profile" in cfg else "elsa_profile.json")
+if "tune_profile" in cfg:
+    cfg.pop("tune_profile") # tune from default settings
+
+def powers(n):
+    values = [1]
+    while values[-1] * 2 <= n:
+        values.append(values[-1] * 2)
+    return values
+
+def parse(value, default):
+    return [int(v) for v in value.split(",")] if value else default
+
+cpu_count = os.cpu_count() or 1
+session = InteractSession.build(cfg)
+profile = tune(session,
+               num_threads=parse(args.threads, powers(cpu_count)),
+               interop_threads=parse(args.interop, [1]),
+               workers=parse(args.workers, powers(cpu_count)),
+               batch_sizes=parse(args.batch_sizes, [1, 4, 16]),
+               duration=args.duration,
+               latency_budget=args.latency_budget)
+with open(output, "w") as f:
+    json.dump(profile, f, indent=2)
+print("best setting: {}, saved to {}".format({k: profile[k] for k in ["num_threads", "interop_threads", "workers", "batch_size"]}, output))
@@ -1,21 +1,225 @@
 #!/usr/bin/env python
+import hmac, json, copy, traceback
 from ..module.interact_session import InteractSession
+from ..module.worker_pool import WorkerPool
+from ..module.admission import Admission, Overloaded
+from ..module.turn_executor import TurnExecutor
+from ..module.tenant_manager import TenantManager
 from nlptools.utils import Config
 
 class BackendBase:
-    def __init__(self, session_config, **args):
+    def __init__(self, session_config, admin_token=None, batch_size=64, record_traffic=None,
+                 admission=None, overload_reply="fallback", turn_executor=None, **args):
         self.config_path = session_config
+        self.admin_token = admin_token
+        self.batch_size = batch_size
+        self.record_traffic = record_traffic
+        self.admission = Admission(**(admission or {}))
+        self.overload_reply = overload_reply
+        self.turn_executor = TurnExecutor(**(turn_executor or {}))
         self.init_session()
 
     def init_session(self):
-        cfg = Config(self.config_path)
+        if isinstance(self.config_path, dict):
+            cfg = copy.deepcopy(self.config_path)
+        else:
+            cfg = Config(self.config_path)
+        if hasattr(self, "session") and hasattr(self.session, "close"):
+            self.session.close()
+        if "tenants" in cfg:
+            # several bots in this process, selected by tenant of request
+            self.session = TenantManager(cfg.tenants, default=cfg.default_tenant if "default_tenant" in cfg else None,
+                                         metrics_config=cfg.metrics if "metrics" in cfg else None,
+                                         record_traffic=self.record_traffic)
+            return
+        if self.record_traffic is not None:
+            # False disables recording of session config
+            cfg["record_traffic"] = self.record_traffic
         self.session = InteractSession.build(cfg)
+        if "worker_pool" in cfg and cfg.worker_pool.get("workers", 1) > 1:
+            self.session = WorkerPool(self.session, **cfg.worker_pool)
+
+    def tenant_session(self, tenant=None):
+        """
+            session of tenant, raise KeyError if not existed
+
+            Input:
+                - tenant: string, default is None for the only session or the default tenant
+        """
+        if isinstance(self.session, TenantManager):
+            return self.session[tenant or None]
+        if tenant:
+            raise KeyError("Tenant {} not existed".format(tenant))
+        return self.session
+
+    def submit_turn(self, chat_id, func, *args, reply=None, loop=None, session_id=None):
+        """
+            run func(*args) in turn executor, so the event loop or dispatcher of chat library is not blocked.
+            Turns of the same chat_id are run in order. If rejected by the full executor, reply gets
+            the fallback of session if overload_reply is "fallback" and the fallback has a response, otherwise nothing
+
+            Input:
+                - chat_id: hashable chat id
+                - func: callable, e.g. self.session
+                - reply: function called with the result, default is None
+                - loop: asyncio event loop to call reply in, default is None to call reply in the turn thread
+                - session_id: session id of the fallback, default is None for chat_id
+
+            Output:
+                - future of the turn, None if rejected
+        """
+        def call_reply(result):
+            if reply is None:
+                return
+            if loop is None:
+                reply(result)
+            else:
+                loop.call_soon_threadsafe(reply, result)
+
+        def done(future):
+            if future.exception() is not None:
+                traceback.print_exception(type(future.exception()), future.exception(), future.exception().__traceback__)
+                return
+            try:
+                call_reply(future.result())
+            except Exception:
+                traceback.print_exc()
+
+        try:
+            future = self.turn_executor.submit(chat_id, func, *args)
+        except Overloaded:
+            if self.overload_reply == "fallback":
+                result = self.session.fallback(chat_id if session_id is None else session_id)
+                if result[1] is not None:
+                    call_reply(result)
+            return None
+        future.add_done_callback(done)
+        return future
+
+    def check_admin(self, token):
+        """
+            check admin token, admin commands are disabled if admin_token is not configured
+        """
+        if not self.admin_token or not token:
+            return False
+        return hmac.compare_digest(str(token), str(self.admin_token))
+
+    def admin(self, command):
+        """
+            run admin command, return the message
+
+            Input:
+                - command: string, "reload SKILL_NAME" to reload one skill in background, "rebuild" to rebuild the whole session
+        """
+        words = command.split()
+        if len(words) == 2 and words[0] == "reload":
+            try:
+                self.session.reload_skill(words[1])
+            except KeyError as err:
+                return str(err)
+            return "reloading {}".format(words[1])
+        if words == ["rebuild"]:
+            self.init_session()
+            return "rebuilt all"
+        return "unknown command: {}".format(command)
+
+    @classmethod
+    def stream_events(cls, pieces):
+        """
+            convert response stream to server-sent events, text pieces as data events,
+            the final response as "response" event
+
+            Input:
+                - pieces: generator from session.stream
+        """
+        for kind, value in pieces:
+            if kind == "token":
+                yield "data: {}\n\n".format(json.dumps({"text": value}))
+            else:
+                yield "event: response\ndata: {}\n\n".format(json.dumps(cls.response_data(*value)))
+
+    @staticmethod
+    def parse_batch(data):
+        """
+            convert batch request to list of (query, session_id), raise ValueError if invalid
+
+            Input:
+                - data: dictionary like {"queries": [{"sessionId": "123", "text": "hello"}, ...]}, with optional "tenant"
+        """
+        if not isinstance(data, dict) or not isinstance(data.get("queries", None), list):
+            raise ValueError("queries list is needed")
+        queries = []
+        for q in data["queries"]:
+            if not isinstance(q, dict) or not isinstance(q.get("text", None), str):
+                raise ValueError("each query needs text")
+            queries.append((q["text"].strip(), str(q.get("sessionId", "123456"))))
+        return queries
+
+    def query_batch(self, queries, tenant=None):
+        """
+            get responses for a list of (query, session_id), answered in chunks of batch_size with batched skill inference
+
+            Input:
+                - queries: list of (query, session_id)
+                - tenant: string, default is None, see tenant_session
+
+            Output:
+                - list of response dictionaries, see response_data
+        """
+        session = self.tenant_session(tenant)
+        results = []
+        for i in range(0, len(queries), self.batch_size):
+            results += session.call_batch(queries[i:i+self.batch_size])
+        return [self.response_data(*r) for r in results]
+
+    def health(self):
+        """
+            health status dictionary
+        """
+        ready = self.session.ready.is_set()
+        return {"status": "ok" if ready else "warming up", "ready": ready, "sessions": len(self.session)}
+
+    def overloaded(self, session_id=None, tenant=None):
+        """
+            reply of request rejected by admission control, the fallback of session if overload_reply is "fallback",
+            otherwise 503. Return (response dictionary, http status)
+
+            Input:
+                - session_id: string, default is None for batch requests which always get 503
+                - tenant: string, default is None, see tenant_session
+        """
+        if session_id is not None and self.overload_reply == "fallback":
+            return self.response_data(*self.tenant_session(tenant).fallback(session_id)), 200
+        return {"code":503, "message":"503 Service Unavailable", "sessionId":session_id, "data":None}, 503
+
+    @staticmethod
+    def not_found(tenant):
+        """
+            response dictionary of unknown tenant
+        """
+        return {"code":404, "message":"Tenant {} not existed".format(tenant), "data":None}
+
+    @staticmethod
+    def response_data(session_id, response, score):
+        """
+            response dictionary for restful api
+
+            Input:
+                - session_id: string
+                - response: response string, None if no response
+                - score: float
+        """
+        score = 0 if response is None else float(score)
+        return {"code":0, "message":"200 OK", 'sessionId':session_id, "data":{"response": response, "score":score}}
 
 class Backend:
     def __new__(cls, session, backend_type="shell", **args):
         if backend_type in ["restful", "restapi"]:
             from .restful import Restful
             return Restful(session, **args)
+        elif backend_type in ["restful_async", "aiohttp"]:
+            from .restful_async import RestfulAsync
+            return RestfulAsync(session, **args)
         elif backend_type == "xmpp":
             from .xmpp import XMPP
             return XMPP(session, **args)
@@ -27,4 +231,4 @@ class Backend:
             return TelegramBackend(session, **args)
         else:
             from .shell import Shell
-            return Shell(session)
+            return Shell(session, **args)
@@ -1,27 +1,101 @@
 #!/usr/bin/env python
 from .backend import BackendBase
+from ..module.admission import Overloaded
 from flask import Flask, request, json, Response
 
 class Restful(BackendBase):
-    def __init__(self, session_config, url_rule, methods, port=5000, **args):
+    def __init__(self, session_config, url_rule, methods, port=5000, metrics_rule="/metrics", health_rule="/health", admin_rule="/admin", batch_rule="/batch", stream_rule="/stream", **args):
         super().__init__(session_config=session_config, **args)
         self.url_rule = url_rule
         self.methods = methods
         self.port = port
         self.app = Flask(__name__)
         self.app.add_url_rule(self.url_rule, methods=self.methods, view_func=self.get_response)
+        self.app.add_url_rule(metrics_rule, methods=["GET"], view_func=self.get_metrics)
+        self.app.add_url_rule(health_rule, methods=["GET"], view_func=self.get_health)
+        self.app.add_url_rule(admin_rule, methods=["POST"], view_func=self.get_admin)
+        self.app.add_url_rule(batch_rule, methods=["POST"], view_func=self.get_batch)
+        self.app.add_url_rule(stream_rule, methods=["POST"], view_func=self.get_stream)
+
+    def get_metrics(self):
+        return Response(json.dumps(self.session.metrics()), mimetype='application/json')
+
+    def get_health(self):
+        health = self.health()
+        return Response(json.dumps(health), status=200 if health["ready"] else 503, mimetype='application/json')
+
+    def get_admin(self):
+        if not self.check_admin(request.form.get('token')):
+            return Response(json.dumps({"code":403, "message":"403 Forbidden"}), status=403, mimetype='application/json')
+        message = self.admin(request.form.get('command', ''))
+        return Response(json.dumps({"code":0, "message":message}), mimetype='application/json')
+
+    def get_batch(self):
+        data = request.get_json(force=True, silent=True)
+        try:
+            queries = self.parse_batch(data)
+        except ValueError as err:
+            return Response(json.dumps({"code":400, "message":str(err)}), status=400, mimetype='application/json')
+        tenant = data.get("tenant", None)
+        try:
+            self.tenant_session(tenant)
+        except KeyError:
+            return self.not_found_response(tenant)
+        try:
+            with self.admission["batch"].admit():
+                data = self.query_batch(queries, tenant=tenant)
+        except Overloaded:
+            return self.overloaded_response()
+        return Response(json.dumps({"code":0, "message":"200 OK", "data":data}), mimetype='application/json')
+
+    def get_stream(self):
+        query = request.form.get('text', '').strip()
+        session_id = request.form.get('sessionId', "123456")
+        tenant = request.form.get('tenant', None)
+        try:
+            session = self.tenant_session(tenant)
+        except KeyError:
+            return self.not_found_response(tenant)
+        queue = self.admission["query"]
+        # admission is checked before streaming starts, the slot is held until the stream is finished
+        try:
+            queue.acquire()
+        except Overloaded:
+            return self.overloaded_response(session_id, tenant)
+
+        def events():
+            try:
+                yield from self.stream_events(session.stream(query, session_id))
+            finally:
+                queue.release()
+        return Response(events(), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+
+    def overloaded_response(self, session_id=None, tenant=None):
+        data, status = self.overloaded(session_id, tenant)
+        return Response(json.dumps(data), status=status, mimetype='application/json',
+                        headers={"Retry-After": "1"} if status == 503 else None)
+
+    def not_found_response(self, tenant):
+        return Response(json.dumps(self.not_found(tenant)), status=404, mimetype='application/json')
 
     def get_response(self):
         query = request.form.get('text').strip()
         session_id = request.form.get('sessionId', "123456")
+        tenant = request.form.get('tenant', None)
+        try:
+            session = self.tenant_session(tenant)
+        except KeyError:
+            return self.not_found_response(tenant)
         if query in ["reset"]:
-            self.init_session()
-            return Response(json.dumps({"code":0, "message":"200 OK", 'sessionId':session_id, "data":{"response": "reset all", "score":1}}), mimetype='application/json')
+            session.reset(session_id)
+            return Response(json.dumps(self.response_data(session_id, "reset the session", 1)), mimetype='application/json')
 
-        session_id, response, score = self.session(query, session_id=session_id)
-        if response is None:
-            return Response(json.dumps({"code":0, "message":"200 OK", 'sessionId':session_id, "data":{"response": None, "score":0}}), mimetype='application/json')
-        return Response(json.dumps({"code":0, "message":"200 OK", 'sessionId':session_id, "data":{"response": response, "score":score}}), mimetype='application/json')
+        try:
+            with self.admission["query"].admit():
+                session_id, response, score = session(query, session_id=session_id)
+        except Overloaded:
+            return self.overloaded_response(session_id, tenant)
+        return Response(json.dumps(self.response_data(session_id, response, score)), mimetype='application/json')
 
     def run(self):
         self.app.run(host='0.0.0.0', port=self.port, threaded=True)
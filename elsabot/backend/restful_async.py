@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+import asyncio
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+from .backend import BackendBase
+from ..module.metrics import metrics
+from ..module.admission import Overloaded
+
+class RestfulAsync(BackendBase):
+    def __init__(self, session_config, url_rule, methods, port=5000, max_workers=4, keepalive_timeout=75,
+                 metrics_rule="/metrics", health_rule="/health", admin_rule="/admin", batch_rule="/batch", stream_rule="/stream", max_request_size=67108864, **args):
+        """
+            Restful api served by asyncio. Model calls are offloaded to a bounded thread pool,
+            queries of the same session are answered in order
+
+            Input:
+                - session_config: path of session config
+                - url_rule: url of api
+                - methods: list of http methods
+                - port: int, default is 5000
+                - max_workers: int, maximum threads for model calls, default is 4
+                - keepalive_timeout: float, seconds to keep idle connections, default is 75
+                - metrics_rule: url of metrics, default is "/metrics"
+                - health_rule: url of health check, default is "/health"
+                - admin_rule: url of admin commands, enabled if admin_token is set, default is "/admin"
+                - batch_rule: url of batch queries, default is "/batch"
+                - stream_rule: url of streaming response as server-sent events, default is "/stream"
+                - max_request_size: int, maximum bytes of request body, default is 64MB
+        """
+        super().__init__(session_config=session_config, **args)
+        self.url_rule = url_rule
+        self.methods = methods
+        self.port = port
+        self.keepalive_timeout = keepalive_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.session_locks = {}
+        self.app = web.Application(client_max_size=max_request_size)
+        for method in self.methods:
+            self.app.router.add_route(method, self.url_rule, self.get_response)
+        self.app.router.add_get(metrics_rule, self.get_metrics)
+        self.app.router.add_get(health_rule, self.get_health)
+        self.app.router.add_post(admin_rule, self.get_admin)
+        self.app.router.add_post(batch_rule, self.get_batch)
+        self.app.router.add_post(stream_rule, self.get_stream)
+        metrics.gauge("queue.sessions_waiting", lambda: sum(l[1] for l in self.session_locks.values()))
+
+    async def get_metrics(self, request):
+        return web.json_response(self.session.metrics())
+
+    async def get_health(self, request):
+        health = self.health()
+        return web.json_response(health, status=200 if health["ready"] else 503)
+
+    async def get_admin(self, request):
+        form = await request.post()
+        if not self.check_admin(form.get('token')):
+            return web.json_response({"code":403, "message":"403 Forbidden"}, status=403)
+        message = await asyncio.get_event_loop().run_in_executor(self.executor, self.admin, form.get('command', ''))
+        return web.json_response({"code":0, "message":message})
+
+    async def get_batch(self, request):
+        try:
+            data = await request.json()
+        except ValueError:
+            # malformed json is rejected by parse_batch
+            data = None
+        try:
+            queries = self.parse_batch(data)
+        except ValueError as err:
+            return web.json_response({"code":400, "message":str(err)}, status=400)
+        tenant = data.get("tenant", None)
+        try:
+            self.tenant_session(tenant)
+        except KeyError:
+            return self.not_found_response(tenant)
+        try:
+            async with self.admission["batch"].admit_async():
+                data = await asyncio.get_event_loop().run_in_executor(self.executor, self.query_batch, queries, tenant)
+        except Overloaded:
+            return self.overloaded_response()
+        return web.json_response({"code":0, "message":"200 OK", "data":data})
+
+    def overloaded_response(self, session_id=None, tenant=None):
+        data, status = self.overloaded(session_id, tenant)
+        return web.json_response(data, status=status, headers={"Retry-After": "1"} if status == 503 else None)
+
+    def not_found_response(self, tenant):
+        return web.json_response(self.not_found(tenant), status=404)
+
+    @asynccontextmanager
+    async def session_lock(self, session_id):
+        """
+            hold the lock of session_id, so queries with the same session_id are answered in order
+        """
+        if session_id not in self.session_locks:
+            self.session_locks[session_id] = [asyncio.Lock(), 0]
+        lock = self.session_locks[session_id]
+        lock[1] += 1
+        try:
+            async with lock[0]:
+                yield
+        finally:
+            lock[1] -= 1
+            if lock[1] < 1:
+                del self.session_locks[session_id]
+
+    async def query(self, query, session_id, tenant=None):
+        """
+            get response without blocking event loop, queries with the same session_id are answered in order.
+            Use the micro batching scheduler of session if available. Raise ..module.admission.Overloaded
+            if rejected by admission control, KeyError if tenant not existed
+
+            Input:
+                - query: string
+                - session_id: string
+                - tenant: string, default is None, see ..backend.BackendBase.tenant_session
+        """
+        session = self.tenant_session(tenant)
+        # admitted before waiting for the session, so waiters are bounded by admission control
+        async with self.admission["query"].admit_async():
+            async with self.session_lock((tenant, session_id)):
+                if getattr(session, "scheduler", None) is not None:
+                    future = session.scheduler.submit(query, session_id)
+                    return (await asyncio.wrap_future(future))[:3]
+                return await asyncio.get_event_loop().run_in_executor(self.executor, session, query, session_id)
+
+    async def get_stream(self, request):
+        form = await request.post()
+        query = form.get('text', '').strip()
+        session_id = form.get('sessionId', "123456")
+        tenant = form.get('tenant', None)
+        try:
+            session = self.tenant_session(tenant)
+        except KeyError:
+            return self.not_found_response(tenant)
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        loop = asyncio.get_event_loop()
+        try:
+            async with self.admission["query"].admit_async():
+                async with self.session_lock((tenant, session_id)):
+                    await response.prepare(request)
+                    events = self.stream_events(session.stream(query, session_id))
+                    while True:
+                        event = await loop.run_in_executor(self.executor, next, events, None)
+                        if event is None:
+                            break
+                        await response.write(event.encode("utf-8"))
+        except Overloaded:
+            return self.overloaded_response(session_id, tenant)
+        await response.write_eof()
+        return response
+
+    async def get_response(self, request):
+        form = await request.post()
+        query = form.get('text', '').strip()
+        session_id = form.get('sessionId', "123456")
+        tenant = form.get('tenant', None)
+        try:
+            session = self.tenant_session(tenant)
+        except KeyError:
+            return self.not_found_response(tenant)
+        if query in ["reset"]:
+            await asyncio.get_event_loop().run_in_executor(self.executor, session.reset, session_id)
+            return web.json_response(self.response_data(session_id, "reset the session", 1))
+
+        try:
+            session_id, response, score = await self.query(query, session_id, tenant)
+        except Overloaded:
+            return self.overloaded_response(session_id, tenant)
+        return web.json_response(self.response_data(session_id, response, score))
+
+    def run(self):
+        web.run_app(self.app, host='0.0.0.0', port=self.port, keepalive_timeout=self.keepalive_timeout)
@@ -3,14 +3,14 @@ from .backend import BackendBase
 
 class Shell(BackendBase):
     def __init__(self, session_config, **args):
-        super().__init__(session_config=session_config)
+        super().__init__(session_config=session_config, **args)
     
     def run(self):
         while True:
             query = input(":: ")
             if query in ["reset"]:
-                self.init_session()
-                print("reset all")
+                self.session.reset("default")
+                print("reset the session")
                 continue
             _, response, score = self.session(query)
             print(response)
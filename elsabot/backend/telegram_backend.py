@@ -1,13 +1,14 @@
 #!/usr/bin/env python
-import random, os, re
+import re, io
 from .backend import BackendBase
+from ..module.audio import TTSPipeline, VoicePipeline
 from telegram.ext import Updater, CommandHandler, MessageHandler, Filters
 from nlptools.audio.speech import Speech_Deepspeech
-from nlptools.audio.utils import *
 
 class TelegramBackend(BackendBase):
-    def __init__(self, session_config, token, deepspeech=None, tts=None, **args):
+    def __init__(self, session_config, token, deepspeech=None, voice_pipeline=None, tts=None, tts_pipeline=None, **args):
         super().__init__(session_config=session_config, **args)
+        self.token = token
         self.updater = Updater(token=token, use_context=True)
         self.dispatcher = self.updater.dispatcher
         self.dispatcher.add_handler(CommandHandler("start", TelegramBackend.start))
@@ -17,11 +18,15 @@ class TelegramBackend(BackendBase):
         self.dispatcher.add_handler(MessageHandler(Filters.voice, self.voice))
         if deepspeech:
             self.ds_model = Speech_Deepspeech(**deepspeech)
+            # in memory decoding and recognition pool, see ..module.audio.VoicePipeline
+            self.voice_pipeline = VoicePipeline(self.ds_model, **(voice_pipeline or {}))
         else:
             self.ds_model = None
+            self.voice_pipeline = None
         if tts:
             from nlptools.audio.tts import MozillaTTS
-            self.tts_model = MozillaTTS(**tts)
+            # sentence splitter, synthesis pool and phrase cache, see ..module.audio.TTSPipeline
+            self.tts_model = TTSPipeline(MozillaTTS(**tts), fingerprint=dict(tts), **(tts_pipeline or {}))
         else:
             self.tts_model = None
 
@@ -32,93 +37,80 @@ class TelegramBackend(BackendBase):
 
     def reset(self, update, context):
         chat_id = update.message.chat_id
-        self.init_session()
-        context.bot.send_message(chat_id=chat_id, text="Chatbot Reset")
+        self.submit_turn(chat_id, self.session.reset, chat_id,
+                         reply=lambda r: context.bot.send_message(chat_id=chat_id, text="Chatbot Reset" if r is None else r[1]))
 
     def get_tts(self, update, context):
+        # handlers only queue the turn, the dispatcher is not blocked
+        self.submit_turn(update.message.chat_id, self._tts_turn, update, context)
+
+    def _tts_turn(self, update, context):
         chat_id = update.message.chat_id
         text = update.message.text.strip()
         text = re.split("\s", text, maxsplit=1)
         if len(text) < 2:
             return
         text = text[1]
+        self.send_speech(context.bot, chat_id, text)
+
+    def send_speech(self, bot, chat_id, text):
+        """
+            send text as voice if tts is available, otherwise as message
+        """
+        ogg = self.tts_model(text) if self.tts_model and text else None
+        if ogg is not None:
+            bot.send_voice(chat_id=chat_id, voice=io.BytesIO(ogg))
+        else:
+            bot.send_message(chat_id=chat_id, text=text)
 
-        random_id = random.randint(0,100000)
-
-        wav_base = "/tmp/{}_{}_%i.wav".format(chat_id, random_id)
-        wav_file = "/tmp/{}_{}.wav".format(chat_id, random_id)
-        ogg_file = "/tmp/{}_{}.ogg".format(chat_id, random_id)
-
-        wav_files = []
-
-        import spacy
-        nlp = spacy.load("en")
-
-        if self.tts_model:
-            doc = nlp(text)
-            for i, sent in enumerate(doc.sents):
-                wavefile = wav_base%i
-                wav_files.append(wavefile)
-                text = sent.text.strip()
-                self.tts_model(text, wavefile)
+    def voice(self, update, context):
+        self.submit_turn(update.message.chat_id, self._voice_turn, update, context)
 
-            concat_wavs(wav_files, wav_file, 0.6)
-            wav2ogg(wav_file, ogg_file)
-            with open(ogg_file, "rb") as oggf:
-                context.bot.send_voice(chat_id=chat_id, voice=oggf)
-            os.remove(wav_file)
-            os.remove(ogg_file)
-            for f in wav_files:
-                os.remove(f)
+    @staticmethod
+    def download_chunks(voice, chunk_size=8192):
+        """
+            yield bytes of voice file while downloading
+        """
+        tfile = voice.get_file()
+        if tfile.file_path and tfile.file_path.startswith("http"):
+            import requests
+            with requests.get(tfile.file_path, stream=True, timeout=30) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size):
+                    yield chunk
         else:
-            context.bot.send_message(chat_id=chat_id, text=text)
+            buf = io.BytesIO()
+            tfile.download(out=buf)
+            yield buf.getvalue()
 
-    def voice(self, update, context):
+    def _voice_turn(self, update, context):
         chat_id = update.message.chat_id
         if not self.ds_model:
             context.bot.send_voice(chat_id=chat_id, voice=update.message.voice)
             return
 
-        #convert voice to text
-        random_id = random.randint(0,100000)
-        ogg_file = "/tmp/{}_{}.ogg".format(chat_id, random_id)
-        wav_file = "/tmp/{}_{}.wav".format(chat_id, random_id)
-        response_wave_file = "/tmp/response_{}_{}.wav".format(chat_id, random_id)
-        response_ogg_file = "/tmp/response_{}_{}.ogg".format(chat_id, random_id)
-
-        update.message.voice.get_file().download(ogg_file)
+        #convert voice to text, recognition starts while downloading
         try:
-            ogg2wav(ogg_file, wav_file)
+            text = self.voice_pipeline.submit(self.download_chunks(update.message.voice)).result()
         except Exception as err:
-            context.bot.send_message(chat_id=chat_id, text=err)
-            os.remove(ogg_file)
+            # download url contains bot token, errors are only logged without it
+            print("voice message error:", repr(err).replace(self.token, "<token>"))
+            context.bot.send_message(chat_id=chat_id, text="Sorry, I could not understand the voice message")
             return
 
-        text = self.ds_model(wav_file)
-        os.remove(ogg_file)
-        os.remove(wav_file)
-
         #query
         chat_id, response, score = self.session(text, session_id=chat_id)
 
         #tts
-        if self.tts_model:
-            self.tts_model(response, response_wave_file)
-            wav2ogg(response_wave_file, response_ogg_file)
-            with open(response_ogg_file, "rb") as oggf:
-                context.bot.send_voice(chat_id=chat_id, voice=oggf)
-            os.remove(response_wave_file)
-            os.remove(response_ogg_file)
-        else:
-            context.bot.send_message(chat_id=chat_id, text=response)
+        self.send_speech(context.bot, chat_id, response)
 
     def query(self, update, context):
         if update.message is None:
             return
         chat_id = update.message.chat_id
         text = update.message.text.strip()
-        chat_id, response, score = self.session(text, session_id=chat_id)
-        context.bot.send_message(chat_id=chat_id, text=response)
+        self.submit_turn(chat_id, self.session, text, chat_id,
+                         reply=lambda r: context.bot.send_message(chat_id=r[0], text=r[1]))
 
     def run(self):
         import logging
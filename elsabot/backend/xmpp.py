@@ -1,20 +1,14 @@
 #!/usr/bin/env python
-from ..module.interact_session import InteractSession
-from nlptools.utils import Config
+from .backend import BackendBase
 from slixmpp import ClientXMPP
 
 class XMPPClient(ClientXMPP):
-    def __init__(self, jid, password, session_config):
+    def __init__(self, jid, password, backend):
         ClientXMPP.__init__(self, jid, password)
         self.jabber_id = jid
+        self.backend = backend
         self.add_event_handler("session_start", self.session_start)
         self.add_event_handler("message", self.message)
-        self.config_path = session_config
-        self.init_session()
-    
-    def init_session(self):
-        cfg = Config(self.config_path)
-        self.session = InteractSession.build(cfg)
 
     def session_start(self, event):
         self.send_presence()
@@ -24,31 +18,39 @@ class XMPPClient(ClientXMPP):
         if msg['type'] in ('chat', 'normal'):
             question = msg["body"]
             from_client = msg["from"]
+            # turns are run out of event loop, replies are sent back in event loop
             if question in ["reset"]:
-                self.init_session()
-                msg.reply("reset all").send()
+                self.backend.submit_turn(str(from_client), self.backend.session.reset, from_client,
+                                         reply=lambda r: msg.reply("reset the session" if r is None else r[1]).send(),
+                                         loop=self.loop, session_id=from_client)
             else:
-                session_id, reply, score = self.session(question, session_id=from_client)
-                if isinstance(reply, dict):
-                    for sid in reply:
-                        if sid == from_client:
-                            msg.reply(reply[sid]).send()
-                        elif sid != self.jabber_id:
-                            self.send_message(mto=sid, mbody=reply[sid])
-                else:
-                    if session_id == from_client:
-                        msg.reply(reply).send()
-                    elif session_id != self.jabber_id:
-                        self.send_message(mto=session_id, mbody=reply)
+                self.backend.submit_turn(str(from_client), self.backend.session, question, from_client,
+                                         reply=lambda r: self.send_reply(msg, from_client, r), loop=self.loop,
+                                         session_id=from_client)
 
         else:
             #TODO, other type of messages
             msg.reply(msg["type"]).send()
 
+    def send_reply(self, msg, from_client, result):
+        session_id, reply, score = result
+        if isinstance(reply, dict):
+            for sid in reply:
+                if sid == from_client:
+                    msg.reply(reply[sid]).send()
+                elif sid != self.jabber_id:
+                    self.send_message(mto=sid, mbody=reply[sid])
+        else:
+            if session_id == from_client:
+                msg.reply(reply).send()
+            elif session_id != self.jabber_id:
+                self.send_message(mto=session_id, mbody=reply)
+
 
-class XMPP:
+class XMPP(BackendBase):
     def __init__(self, session_config, jid, password, host, port=5222, proxy_host=None, proxy_port=None, **args):
-        self.xmpp = XMPPClient(jid=jid, password=password, session_config=session_config)
+        super().__init__(session_config=session_config, **args)
+        self.xmpp = XMPPClient(jid=jid, password=password, backend=self)
         self.xmpp.register_plugin('xep_0030') # Service Discovery
         self.xmpp.register_plugin('xep_0004') # Data Forms
         self.xmpp.register_plugin('xep_0060') # PubSub
@@ -70,4 +72,3 @@ class XMPP:
             }
         self.xmpp.connect((self.host, self.port))
         self.xmpp.process(forever=True)
-
@@ -120,9 +120,38 @@ class GenerativeTracker(nn.Module):
         
         return sequence_out, encoder_hidden
 
-    def beam_search(self, encoder_out, utterance_mask, incre_state=None):
+    def settled_tokens(self, output_buf, settled_len, step_callback, final=False):
+        """
+            call step_callback(dialog_index, token_ids) with new tokens shared by all beams of each dialog,
+            these tokens will not change in the following steps. Tokens after eos are not sent
+
+            Input:
+                - output_buf: tensor of beam outputs, shape (bsz*beam_size, current_len)
+                - settled_len: list of sent length of each dialog, None if eos is sent, updated inplace
+                - step_callback: callable
+                - final: bool, send all tokens of the best beam, default is False
+        """
+        beams = output_buf.view(-1, self.beam_size, output_buf.size(1))
+        if final:
+            same_len = [output_buf.size(1)] * beams.size(0)
+        else:
+            same_len = beams.eq(beams[:, :1]).all(dim=1).long().cumprod(dim=1).sum(dim=1).tolist()
+        for j in range(beams.size(0)):
+            if settled_len[j] is None or same_len[j] <= settled_len[j]:
+                continue
+            tokens = beams[j, 0, settled_len[j]:same_len[j]].tolist()
+            if self.eos_id in tokens:
+                tokens = tokens[:tokens.index(self.eos_id)]
+                settled_len[j] = None
+            else:
+                settled_len[j] = same_len[j]
+            if tokens:
+                step_callback(j, tokens)
+
+    def beam_search(self, encoder_out, utterance_mask, incre_state=None, step_callback=None):
         bsz = encoder_out.size(0)
         max_len = encoder_out.size(1)
+        settled_len = [1] * bsz # bos is not sent
 
         # initialize buffers
         output_buf = encoder_out.new_zeros(bsz * self.beam_size, max_len).long()
@@ -130,9 +159,10 @@ class GenerativeTracker(nn.Module):
         scores_buf = encoder_out.new_zeros(bsz * self.beam_size)
         finalized = utterance_mask.new_zeros(bsz * self.beam_size).byte()
 
-        # expand encoder out and utterance mask
-        encoder_out = encoder_out.repeat(bsz*self.beam_size, 1, 1)
-        utterance_mask = utterance_mask.repeat(self.beam_size, 1)
+        # expand encoder out and utterance mask, beams of each dialog are contiguous
+        encoder_out = encoder_out.repeat_interleave(self.beam_size, dim=0)
+        utterance_mask = utterance_mask.repeat_interleave(self.beam_size, dim=0)
+        beam_offset = torch.arange(bsz, device=output_buf.device).repeat_interleave(self.beam_size) * self.beam_size
 
         for i in range(max_len - 1):
             #print("="*20)
@@ -191,15 +221,12 @@ class GenerativeTracker(nn.Module):
             #print("output_max_current", output_max_current)
             #print("output_max_prev", output_max_prev)
 
-            #reorder previous outputs
-            for j in range(bsz):
-                output_buf[j*self.beam_size:(j+1)*self.beam_size, :i+1] =\
-                        output_buf[j*self.beam_size:(j+1)*self.beam_size, :i+1][output_max_prev, :]
-                scores_buf[j*self.beam_size:(j+1)*self.beam_size] =\
-                        scores_buf[j*self.beam_size:(j+1)*self.beam_size][output_max_prev]
-                finalized[j*self.beam_size:(j+1)*self.beam_size] =\
-                        finalized[j*self.beam_size:(j+1)*self.beam_size][output_max_prev]
-           
+            #reorder previous outputs, output_max_prev is the beam index inside each dialog
+            output_max_prev = output_max_prev + beam_offset
+            output_buf[:, :i+1] = output_buf[output_max_prev, :i+1]
+            scores_buf = scores_buf[output_max_prev]
+            finalized = finalized[output_max_prev]
+
             self.decoder.reorder_incremental_state(incre_state, output_max_prev) 
 
             output_buf[:, i+1] = output_max_current
@@ -209,6 +236,9 @@ class GenerativeTracker(nn.Module):
 
             finalized = finalized | output_max_current.eq(self.eos_id)
 
+            if step_callback is not None:
+                self.settled_tokens(output_buf[:, :i+2], settled_len, step_callback)
+
             if finalized.all():
                 break
 
@@ -219,12 +249,15 @@ class GenerativeTracker(nn.Module):
             output[j, :] = output_buf[j*self.beam_size, :]
             scores[j] = scores_buf[j*self.beam_size]
 
+        if step_callback is not None:
+            self.settled_tokens(output_buf, settled_len, step_callback, final=True)
+
         #print("scores_buf", scores_buf.shape)
         #print("output_buf", output_buf.shape)
 
         return output, scores
 
-    def forward(self, dialogs, incre_state=None):
+    def forward(self, dialogs, incre_state=None, step_callback=None):
         #encoder
         utterance_mask = dialogs["utterance_mask"]
         encoder_out, _ = self.dialog_embedding(dialogs['utterance'].data, utterance_mask.data, dialogs["sentiment"].data, dialogs["entity"].data)
@@ -245,5 +278,5 @@ class GenerativeTracker(nn.Module):
             loss = self.loss_function(output_probs_expand, target_out)
             return output_probs, loss
         else:
-            return self.beam_search(encoder_out, utterance_mask.data, incre_state)
+            return self.beam_search(encoder_out, utterance_mask.data, incre_state, step_callback)
 
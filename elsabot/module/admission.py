@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+import asyncio, threading
+from contextlib import contextmanager, asynccontextmanager
+from .metrics import metrics
+
+'''
+    Author: Pengjia Zhu (zhupengjia@gmail.com)
+'''
+
+
+class Overloaded(Exception):
+    def __init__(self, queue, reason):
+        """
+            Raised when a request is rejected by admission control
+
+            Input:
+                - queue: string, queue name
+                - reason: "queue_full" or "deadline"
+        """
+        super(Overloaded, self).__init__("{} queue overloaded: {}".format(queue, reason))
+        self.queue = queue
+        self.reason = reason
+
+
+class AdmissionQueue:
+    def __init__(self, name, max_inflight=None, max_queue=64, deadline=5.):
+        """
+            Bounded queue in front of session calls. At most max_inflight requests are served together,
+            others wait in the queue. Requests are rejected at once if the queue is full,
+            or if they can not be started before the deadline. Started requests are never cancelled
+
+            Special usage:
+                - with queue.admit(): block in threads, same as acquire() and release()
+                - async with queue.admit_async(): block in asyncio event loop
+
+            Input:
+                - name: string, queue name
+                - max_inflight: int, maximum requests served together, default is None for no limit
+                - max_queue: int, maximum waiting requests, default is 64
+                - deadline: float, maximum seconds to wait in queue, default is 5
+        """
+        self.name = name
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self.inflight = 0
+        self.waiting = 0
+        self.condition = threading.Condition()
+        self.async_condition = None
+        metrics.gauge("admission.{}.inflight".format(name), lambda: self.inflight)
+        metrics.gauge("admission.{}.waiting".format(name), lambda: self.waiting)
+
+    def _reject(self, reason):
+        metrics.incr("admission.{}.rejected.{}".format(self.name, reason))
+        raise Overloaded(self.name, reason)
+
+    def _available(self):
+        return self.inflight < self.max_inflight
+
+    def acquire(self):
+        """
+            wait for a slot in threads, raise Overloaded if rejected
+        """
+        if self.max_inflight is None:
+            return
+        with self.condition:
+            if not self._available():
+                if self.waiting >= self.max_queue:
+                    self._reject("queue_full")
+                self.waiting += 1
+                try:
+                    admitted = self.condition.wait_for(self._available, timeout=self.deadline)
+                finally:
+                    self.waiting -= 1
+                if not admitted:
+                    self._reject("deadline")
+            self.inflight += 1
+
+    def release(self):
+        """
+            release the slot got by acquire
+        """
+        if self.max_inflight is None:
+            return
+        with self.condition:
+            self.inflight -= 1
+            self.condition.notify()
+
+    @contextmanager
+    def admit(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def admit_async(self):
+        if self.max_inflight is None:
+            yield
+            return
+        if self.async_condition is None:
+            self.async_condition = asyncio.Condition()
+        async with self.async_condition:
+            if not self._available():
+                if self.waiting >= self.max_queue:
+                    self._reject("queue_full")
+                self.waiting += 1
+                try:
+                    await asyncio.wait_for(self.async_condition.wait_for(self._available), timeout=self.deadline)
+                except asyncio.TimeoutError:
+                    self._reject("deadline")
+                finally:
+                    self.waiting -= 1
+            self.inflight += 1
+        try:
+            yield
+        finally:
+            async with self.async_condition:
+                self.inflight -= 1
+                self.async_condition.notify()
+
+
+class Admission:
+    def __init__(self, **queues):
+        """
+            Named admission queues, queues not configured have no limit
+
+            Input:
+                - queues: dictionary of queue name and its parameters, see AdmissionQueue
+                    for example {"query": {"max_inflight": 8, "max_queue": 64, "deadline": 2}}
+        """
+        self.queues = {name: AdmissionQueue(name, **queues[name]) for name in queues}
+
+    def __getitem__(self, name):
+        if name not in self.queues:
+            self.queues[name] = AdmissionQueue(name)
+        return self.queues[name]
@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+import io, os, json, wave, hashlib, tempfile, threading, subprocess
+from contextlib import closing
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from .metrics import metrics
+
+'''
+    Author: Pengjia Zhu (zhupengjia@gmail.com)
+'''
+
+
+def ffmpeg(data, input_args, output_args):
+    """
+        convert audio bytes via ffmpeg pipes without temporary files, return converted bytes
+
+        Input:
+            - data: audio bytes
+            - input_args: list of ffmpeg input options, e.g. ["-f", "wav"]
+            - output_args: list of ffmpeg output options, e.g. ["-c:a", "libopus", "-f", "ogg"]
+    """
+    command = ["ffmpeg", "-loglevel", "error"] + list(input_args) + ["-i", "pipe:0"] + list(output_args) + ["pipe:1"]
+    process = subprocess.run(command, input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        raise RuntimeError("ffmpeg failed: {}".format(process.stderr.decode("utf-8", "ignore").strip()))
+    return process.stdout
+
+
+def wav2ogg(wav):
+    """
+        wav bytes to ogg opus bytes, the voice format of telegram
+    """
+    return ffmpeg(wav, ["-f", "wav"], ["-c:a", "libopus", "-f", "ogg"])
+
+
+def concat_wav(wavs, silence=0.6):
+    """
+        concat wav bytes in memory with silence between them, all wavs must have the same format
+
+        Input:
+            - wavs: list of wav bytes
+            - silence: float, seconds of silence between two wavs, default is 0.6
+    """
+    output = io.BytesIO()
+    writer = None
+    for i, data in enumerate(wavs):
+        with wave.open(io.BytesIO(data), "rb") as reader:
+            params = reader.getparams()
+            if writer is None:
+                writer = wave.open(output, "wb")
+                writer.setparams(params)
+                first = params
+            elif params[:3] != first[:3]:
+                raise ValueError("wav format mismatched: {} and {}".format(params, first))
+            elif silence > 0:
+                writer.writeframes(b"\0" * (int(silence * first.framerate) * first.sampwidth * first.nchannels))
+            writer.writeframes(reader.readframes(params.nframes))
+    if writer is None:
+        raise ValueError("no wav to concat")
+    writer.close()
+    return output.getvalue()
+
+
+class TTSPipeline:
+    def __init__(self, tts_model, workers=2, cache_size=1000, cache_bytes=64*1024**2, cache_dir=None, cache_dir_bytes=1024**3,
+                 silence=0.6, spacy_model="en", fingerprint=None):
+        """
+            Text to speech with sentences synthesized concurrently and cached by content. Sentence splitter is loaded once,
+            audio is kept in memory, only the tts model writes a temporary wav file since it only supports file output
+
+            Input:
+                - tts_model: callable as tts_model(text, wav_file), e.g. nlptools.audio.tts.MozillaTTS
+                - workers: int, sentences synthesized together, default is 2. Set to 1 if tts_model is not thread safe
+                - cache_size: int, maximum sentences cached in memory, default is 1000
+                - cache_bytes: int, maximum bytes of audio cached in memory, default is 64MB
+                - cache_dir: directory to keep synthesized sentences across restarts, default is None
+                - cache_dir_bytes: int, maximum bytes of audio kept in cache_dir, least recently used files are removed,
+                    default is 1GB
+                - silence: float, seconds of silence between sentences, default is 0.6
+                - spacy_model: spacy model name of sentence splitter, default is "en"
+                - fingerprint: json serializable config of tts_model such as model files, voice and sample rate, part of
+                    the cache key so cached audio of another model is not used, default is None for the class name of tts_model
+        """
+        import spacy
+        self.tts_model = tts_model
+        self.nlp = spacy.load(spacy_model)
+        self.cache_size = cache_size
+        self.cache_bytes = cache_bytes
+        self.cache_dir = cache_dir
+        self.cache_dir_bytes = cache_dir_bytes
+        self.silence = silence
+        if fingerprint is None:
+            fingerprint = type(tts_model).__module__ + "." + type(tts_model).__name__
+        self.fingerprint = hashlib.sha256(json.dumps(fingerprint, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.cache_used = 0
+        self.futures = {}
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.files = OrderedDict() # file sizes in cache_dir, least recently used first
+        self.files_used = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._scan_cache_dir()
+        metrics.gauge("tts.cache", lambda: len(self.cache))
+        metrics.gauge("tts.cache.bytes", lambda: self.cache_used)
+        metrics.gauge("tts.cache_dir.bytes", lambda: self.files_used)
+
+    def _scan_cache_dir(self):
+        """
+            index files of cache_dir by modified time, remove temporary files left by a crash
+        """
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+            elif name.endswith(".wav"):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self.files[key] = size
+            self.files_used += size
+        with self.lock:
+            self._evict_files()
+
+    def _evict_files(self):
+        """
+            remove least recently used files until cache_dir is under cache_dir_bytes, called with lock
+        """
+        while self.files and self.files_used > self.cache_dir_bytes:
+            key, size = self.files.popitem(last=False)
+            self.files_used -= size
+            try:
+                os.remove(os.path.join(self.cache_dir, key + ".wav"))
+            except FileNotFoundError:
+                pass
+
+    def split(self, text):
+        """
+            split text to sentences
+        """
+        return [sent.text.strip() for sent in self.nlp(text).sents if sent.text.strip()]
+
+    def key(self, sentence):
+        return hashlib.sha256((self.fingerprint + "\n" + sentence).encode("utf-8")).hexdigest()
+
+    def _synthesize(self, sentence, key):
+        if self.cache_dir is not None:
+            path = os.path.join(self.cache_dir, key + ".wav")
+            with self.lock:
+                cached = key in self.files
+                if cached:
+                    self.files.move_to_end(key)
+            if cached:
+                try:
+                    with open(path, "rb") as f:
+                        wav = f.read()
+                    # modified time keeps the order of least recently used after restart
+                    os.utime(path)
+                    return wav
+                except FileNotFoundError:
+                    pass
+        with metrics.timer("tts.synthesize"):
+            fd, wav_file = tempfile.mkstemp(suffix=".wav")
+            os.close(fd)
+            try:
+                self.tts_model(sentence, wav_file)
+                with open(wav_file, "rb") as f:
+                    wav = f.read()
+            finally:
+                os.remove(wav_file)
+        if self.cache_dir is not None:
+            with open(path + ".tmp", "wb") as f:
+                f.write(wav)
+            os.replace(path + ".tmp", path)
+            with self.lock:
+                self.files_used += len(wav) - self.files.pop(key, 0)
+                self.files[key] = len(wav)
+                self._evict_files()
+        return wav
+
+    def synthesize(self, sentence):
+        """
+            wav bytes of one sentence, from cache if synthesized before. Return a future
+
+            Input:
+                - sentence: string
+        """
+        key = self.key(sentence)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                metrics.incr("tts.cache.hit")
+                future = Future()
+                future.set_result(self.cache[key])
+                return future
+            if key in self.futures:
+                # the same sentence is being synthesized
+                return self.futures[key]
+            metrics.incr("tts.cache.miss")
+            future = self.futures[key] = self.executor.submit(self._synthesize, sentence, key)
+
+        def done(future):
+            with self.lock:
+                self.futures.pop(key, None)
+                if future.exception() is None and len(future.result()) <= self.cache_bytes:
+                    self.cache[key] = future.result()
+                    self.cache_used += len(future.result())
+                    while len(self.cache) > self.cache_size or self.cache_used > self.cache_bytes:
+                        self.cache_used -= len(self.cache.popitem(last=False)[1])
+        future.add_done_callback(done)
+        return future
+
+    def __call__(self, text, output_format="ogg"):
+        """
+            speech of text
+
+            Input:
+                - text: string
+                - output_format: "ogg" for ogg opus bytes, "wav" for wav bytes, default is "ogg"
+        """
+        sentences = self.split(text)
+        if len(sentences) < 1:
+            return None
+        futures = [self.synthesize(s) for s in sentences]
+        wav = concat_wav([f.result() for f in futures], self.silence)
+        if output_format == "wav":
+            return wav
+        with metrics.timer("tts.encode"):
+            return wav2ogg(wav)
+
+
+class VoicePipeline:
+    def __init__(self, asr_model, workers=2, sample_rate=16000, chunk_size=8192):
+        """
+            Speech to text from encoded audio chunks, e.g. a voice message being downloaded. Audio is decoded and
+            resampled by an ffmpeg pipe while it is received. If the deepspeech model supports streaming, recognition
+            is fed with the decoded samples at once, otherwise the decoded samples are passed to asr_model via one
+            temporary wav file. At most workers voice messages are recognized together
+
+            Input:
+                - asr_model: callable as asr_model(wav_file), e.g. nlptools.audio.speech.Speech_Deepspeech. The deepspeech
+                    model is used for streaming if asr_model or asr_model.model has createStream
+                - workers: int, voice messages recognized together, default is 2
+                - sample_rate: int, sample rate of asr model, default is 16000
+                - chunk_size: int, bytes of decoded audio fed each time, default is 8192
+        """
+        self.asr_model = asr_model
+        self.sample_rate = sample_rate
+        self.chunk_size = chunk_size
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        model = getattr(asr_model, "model", asr_model)
+        self.stream_model = model if hasattr(model, "createStream") else None
+
+    def _feed(self, chunks, stdin, errors):
+        try:
+            for chunk in chunks:
+                stdin.write(chunk)
+        except (BrokenPipeError, ValueError):
+            pass
+        except Exception as err:
+            # e.g. download failed, raised from _samples
+            errors.append(err)
+        finally:
+            try:
+                stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def _samples(self, chunks):
+        """
+            decode and resample chunks to 16 bit mono pcm, yield bytes with even length
+        """
+        command = ["ffmpeg", "-loglevel", "error", "-i", "pipe:0",
+                   "-f", "s16le", "-ac", "1", "-ar", str(self.sample_rate), "pipe:1"]
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        errors = []
+        feeder = threading.Thread(target=self._feed, args=(chunks, process.stdin, errors), daemon=True)
+        feeder.start()
+        try:
+            rest = b""
+            while True:
+                data = process.stdout.read(self.chunk_size)
+                if not data:
+                    break
+                data = rest + data
+                cut = len(data) - len(data) % 2
+                rest = data[cut:]
+                yield data[:cut]
+            feeder.join()
+            stderr = process.stderr.read()
+            if errors:
+                process.wait()
+                raise errors[0]
+            if process.wait() != 0:
+                raise RuntimeError("ffmpeg failed: {}".format(stderr.decode("utf-8", "ignore").strip()))
+        finally:
+            # recognition failed or stopped early, the feeder blocked on a full pipe is released by killing ffmpeg
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            feeder.join()
+            if hasattr(chunks, "close"):
+                chunks.close()
+            for pipe in [process.stdout, process.stderr]:
+                pipe.close()
+
+    def transcribe(self, chunks):
+        """
+            text of audio
+
+            Input:
+                - chunks: iterator of encoded audio bytes, e.g. ogg opus of telegram voice message
+        """
+        with metrics.timer("asr.transcribe"):
+            if self.stream_model is not None:
+                import numpy
+                stream = self.stream_model.createStream()
+                # ffmpeg and download are stopped at once if recognition fails
+                with closing(self._samples(chunks)) as samples:
+                    if hasattr(stream, "feedAudioContent"):
+                        for data in samples:
+                            stream.feedAudioContent(numpy.frombuffer(data, numpy.int16))
+                        return stream.finishStream()
+                    # deepspeech before 0.7
+                    for data in samples:
+                        self.stream_model.feedAudioContent(stream, numpy.frombuffer(data, numpy.int16))
+                    return self.stream_model.finishStream(stream)
+
+            pcm = b"".join(self._samples(chunks))
+            fd, wav_file = tempfile.mkstemp(suffix=".wav")
+            os.close(fd)
+            try:
+                with wave.open(wav_file, "wb") as writer:
+                    writer.setnchannels(1)
+                    writer.setsampwidth(2)
+                    writer.setframerate(self.sample_rate)
+                    writer.writeframes(pcm)
+                return self.asr_model(wav_file)
+            finally:
+                os.remove(wav_file)
+
+    def submit(self, chunks):
+        """
+            transcribe in the bounded pool, return a future of text
+
+            Input:
+                - chunks: iterator of encoded audio bytes
+        """
+        return self.executor.submit(self.transcribe, chunks)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+import os, sys, time, json, random, itertools, threading, multiprocessing, torch
+from .batch_scheduler import BatchScheduler
+from .benchmark import latency_summary
+from .worker_pool import WorkerPool
+
+'''
+    Author: Pengjia Zhu (zhupengjia@gmail.com)
+'''
+
+
+def set_threads(num_threads=None, interop_threads=None):
+    """
+        set torch intra-op and inter-op threads, inter-op threads can only be set before any parallel work.
+        Return False if inter-op threads could not be set
+    """
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if interop_threads:
+        if not hasattr(torch, "set_num_interop_threads"):
+            return False
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            return False
+    return True
+
+
+def apply_profile(config, profile_path):
+    """
+        apply tuned profile to torch threads and config, used by ..module.interact_session.InteractSession.build.
+        Ignored if the profile is not existed
+
+        Input:
+            - config: configure dictionary, scheduler and worker_pool are updated
+            - profile_path: json file written by tune
+    """
+    if not os.path.exists(profile_path):
+        print("tune profile {} not existed, ignored".format(profile_path))
+        return
+    with open(profile_path) as f:
+        profile = json.load(f)
+    if not set_threads(profile.get("num_threads", None), profile.get("interop_threads", None)):
+        print("inter-op threads of tune profile can not be set, torch parallel work already started")
+    if "batch_size" in profile:
+        scheduler = dict(config["scheduler"]) if "scheduler" in config and config["scheduler"] else {}
+        scheduler["max_batch_size"] = profile["batch_size"]
+        config["scheduler"] = scheduler
+    if "workers" in profile:
+        worker_pool = dict(config["worker_pool"]) if "worker_pool" in config and config["worker_pool"] else {}
+        worker_pool["workers"] = profile["workers"]
+        worker_pool["num_threads"] = profile.get("num_threads", None)
+        config["worker_pool"] = worker_pool
+
+
+def synthetic_queries(session, max_queries=1000):
+    """
+        queries for tuning, user says from dialogflows of skills, or some greetings if none
+
+        Input:
+            - session: instance of ..module.interact_session.InteractSession
+            - max_queries: int, default is 1000
+    """
+    queries = []
+    for skill in session.topic_manager.skills.values():
+        dialogflow = getattr(skill, "dialogflow", None)
+        if dialogflow is None or getattr(dialogflow, "dialogs", None) is None:
+            continue
+        for says in dialogflow.dialogs["user_says"].dropna():
+            queries += says
+    if len(queries) < 1:
+        queries = ["hello", "how are you", "what can you do", "tell me a joke", "thank you", "bye"]
+    random.shuffle(queries)
+    return queries[:max_queries]
+
+
+def _probe_interop(interop_threads, conn):
+    conn.send(set_threads(None, interop_threads))
+    conn.close()
+
+
+def interop_settable(interop_threads):
+    """
+        whether inter-op threads can be set in forked trials, not possible once the parent process started
+        parallel work such as warmup
+
+        Input:
+            - interop_threads: int
+    """
+    context = multiprocessing.get_context("fork")
+    parent_conn, child_conn = context.Pipe()
+    process = context.Process(target=_probe_interop, args=(interop_threads, child_conn))
+    process.start()
+    child_conn.close()
+    try:
+        return bool(parent_conn.poll(60) and parent_conn.recv())
+    except EOFError:
+        return False
+    finally:
+        process.join()
+
+
+def _trial(session, setting, queries, duration, conn):
+    set_threads(setting["num_threads"], setting["interop_threads"])
+    session.scheduler = None
+    session.start()
+    if setting["batch_size"] > 1:
+        session.scheduler = BatchScheduler(session.call_batch, max_batch_size=setting["batch_size"])
+    target = session
+    if setting["workers"] > 1:
+        target = WorkerPool(session, workers=setting["workers"], worker_threads=setting["batch_size"],
+                            num_threads=setting["num_threads"])
+
+    # closed loop clients, enough to fill all batches of all workers
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client(client_id):
+        n = 0
+        while time.time() < deadline:
+            start = time.time()
+            target(queries[n % len(queries)], session_id="tune-{}-{}".format(client_id, n // 5))
+            with lock:
+                latencies.append(time.time() - start)
+            n += 1
+
+    start_time = time.time()
+    clients = [threading.Thread(target=client, args=(i,), daemon=True)
+               for i in range(setting["workers"] * setting["batch_size"])]
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join()
+    elapsed = time.time() - start_time
+    if target is not session:
+        target.close()
+    conn.send({"throughput_qps": len(latencies) / elapsed, "latency": latency_summary(latencies)})
+    conn.close()
+
+
+def run_trial(session, setting, queries, duration=5, timeout=600):
+    """
+        run synthetic turns with setting in a forked process, so torch thread settings don't leak
+
+        Input:
+            - session: instance of ..module.interact_session.InteractSession
+            - setting: dictionary of num_threads, interop_threads, workers and batch_size
+            - queries: list of query strings
+            - duration: float, seconds of load, default is 5
+            - timeout: float, seconds to wait for trial, default is 600
+    """
+    context = multiprocessing.get_context("fork")
+    parent_conn, child_conn = context.Pipe()
+    process = context.Process(target=_trial, args=(session, setting, queries, duration, child_conn), daemon=False)
+    process.start()
+    child_conn.close()
+    try:
+        if not parent_conn.poll(timeout):
+            raise RuntimeError("trial timeout")
+        return parent_conn.recv()
+    except (EOFError, RuntimeError) as err:
+        return {"error": str(err)}
+    finally:
+        process.join(timeout=10)
+        if process.is_alive():
+            process.terminate()
+
+
+def tune(session, num_threads, interop_threads, workers, batch_sizes, duration=5, latency_budget=0.5):
+    """
+        grid search of torch threads, worker count and batch size. The best setting has the largest throughput
+        with p95 latency under budget, or the smallest p95 latency if none is under budget
+
+        Input:
+            - session: instance of ..module.interact_session.InteractSession
+            - num_threads: list of torch intra-op threads
+            - interop_threads: list of torch inter-op threads
+            - workers: list of worker process count
+            - batch_sizes: list of maximum micro batch size
+            - duration: float, seconds of each trial, default is 5
+            - latency_budget: float, seconds of p95 latency budget, default is 0.5
+
+        Output:
+            - profile dictionary, with all trial results in "trials"
+    """
+    queries = synthetic_queries(session)
+    interop = [i for i in interop_threads if i]
+    if interop and not interop_settable(interop[0]):
+        # every value would run the same trial
+        print("inter-op threads can not be changed after the session is built, interop_threads is not tuned")
+        interop_threads = [None]
+    trials = []
+    for t, i, w, b in itertools.product(num_threads, interop_threads, workers, batch_sizes):
+        setting = {"num_threads": t, "interop_threads": i, "workers": w, "batch_size": b}
+        result = run_trial(session, setting, queries, duration=duration)
+        trials.append({**setting, **result})
+        print(json.dumps(trials[-1]))
+
+    valid = [r for r in trials if "error" not in r and r["latency"]["count"] > 0]
+    if len(valid) < 1:
+        raise RuntimeError("all trials failed")
+    in_budget = [r for r in valid if r["latency"]["p95_ms"] <= latency_budget * 1000]
+    if in_budget:
+        best = max(in_budget, key=lambda r: r["throughput_qps"])
+    else:
+        best = min(valid, key=lambda r: r["latency"]["p95_ms"])
+    return {"num_threads": best["num_threads"],
+            "interop_threads": best["interop_threads"],
+            "workers": best["workers"],
+            "batch_size": best["batch_size"],
+            "throughput_qps": best["throughput_qps"],
+            "p95_ms": best["latency"]["p95_ms"],
+            "machine": {"cpu_count": os.cpu_count(), "platform": sys.platform},
+            "trials": trials}
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+import time, queue, threading
+from concurrent.futures import Future
+from .metrics import metrics
+
+'''
+    Author: Pengjia Zhu (zhupengjia@gmail.com)
+'''
+
+
+class BatchScheduler:
+    def __init__(self, batch_func, max_batch_size=16, max_wait=0.005):
+        """
+            Micro batching scheduler. Queries from concurrent sessions are gathered
+            within a short wait window and answered together via batch_func
+
+            Input:
+                - batch_func: function to answer a list of (query, session_id), supporting return_topic and
+                    return_exceptions, see ..module.interact_session.InteractSession.call_batch
+                - max_batch_size: int, maximum number of queries in one batch, default is 16
+                - max_wait: float, seconds to wait for more queries after the first one arrived, default is 0.005
+        """
+        self.batch_func = batch_func
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.start()
+
+    def start(self):
+        """
+            start the batching thread
+        """
+        self.queue = queue.Queue()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=10):
+        """
+            stop the batching thread, queued queries get RuntimeError
+
+            Input:
+                - timeout: float, seconds to wait for the running batch, default is 10
+        """
+        self.stopped.set()
+        self.queue.put(None)
+        self.thread.join(timeout)
+        self._fail_pending()
+
+    def _fail_pending(self):
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[2].set_exception(RuntimeError("scheduler stopped"))
+
+    def submit(self, query, session_id="default"):
+        """
+            queue a query, return a future of (session_id, response, score, topic)
+
+            Input:
+                - query: string
+                - session_id: string, session id, default is "default"
+        """
+        future = Future()
+        future.submit_time = time.time()
+        self.queue.put((query, session_id, future))
+        if self.stopped.is_set():
+            self._fail_pending()
+        return future
+
+    def __call__(self, query, session_id="default", return_topic=False):
+        """
+            get response, block until the batch containing this query is finished
+
+            Input:
+                - query: string
+                - session_id: string, session id, default is "default"
+                - return_topic: bool, also return the chosen topic, default is False
+        """
+        result = self.submit(query, session_id).result()
+        return result if return_topic else result[:3]
+
+    def _collect(self):
+        item = self.queue.get()
+        if item is None:
+            return []
+        batch = [item]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                break
+            batch.append(item)
+        return batch
+
+    def _loop(self):
+        while not self.stopped.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+            for _, _, future in batch:
+                metrics.observe("stage.scheduler_wait", time.time() - future.submit_time)
+            try:
+                # one bad query should not fail other sessions, errors are returned per query
+                results = self.batch_func([(query, session_id) for query, session_id, _ in batch],
+                                          return_topic=True, return_exceptions=True)
+            except Exception as err:
+                for _, _, future in batch:
+                    future.set_exception(err)
+                continue
+            for (_, _, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+import sys, time, json, resource, threading, numpy
+from concurrent.futures import ThreadPoolExecutor
+
+'''
+    Author: Pengjia Zhu (zhupengjia@gmail.com)
+'''
+
+
+class TrafficRecorder:
+    def __init__(self, path):
+        """
+            Record queries as json lines of {"time", "session", "text"}, used for replay benchmark
+
+            Input:
+                - path: recording file, appended if existed
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "a", buffering=1)
+
+    def record(self, queries):
+        """
+            Input:
+                - queries: list of (query, session_id)
+        """
+        now = time.time()
+        lines = "".join(json.dumps({"time": now, "session": str(session_id), "text": query}) + "\n"
+                        for query, session_id in queries)
+        with self.lock:
+            self.file.write(lines)
+
+    @staticmethod
+    def load(path):
+        """
+            load recording, return list of records sorted by time
+        """
+        records = []
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+        return sorted(records, key=lambda r: r["time"])
+
+
+def latency_summary(latencies):
+    """
+        latency percentiles in milliseconds
+
+        Input:
+            - latencies: list of seconds
+    """
+    if len(latencies) < 1:
+        return {"count": 0}
+    ms = numpy.array(latencies) * 1000
+    return {"count": len(ms),
+            "mean_ms": float(ms.mean()),
+            "p50_ms": float(numpy.percentile(ms, 50)),
+            "p95_ms": float(numpy.percentile(ms, 95)),
+            "p99_ms": float(numpy.percentile(ms, 99)),
+            "max_ms": float(ms.max())}
+
+
+def _vm_hwm(pid):
+    """
+        peak resident memory in MB of a live process from /proc, None if not available
+    """
+    try:
+        with open("/proc/{}/status".format(pid)) as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def peak_rss(session=None):
+    """
+        peak resident memory in MB of this process and the largest child process, such as forked workers
+
+        Input:
+            - session: instance of ..module.worker_pool.WorkerPool to read the peak memory of its live workers,
+                default is None
+    """
+    # ru_maxrss is in bytes on mac, in KB on linux
+    scale = 1024. ** 2 if sys.platform == "darwin" else 1024.
+    report = {"self_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale}
+    # RUSAGE_CHILDREN only counts children already waited, live workers are read from /proc
+    workers = [_vm_hwm(p.pid) for p in getattr(session, "processes", [])]
+    workers = [m for m in workers if m is not None]
+    if workers:
+        report["workers_mb"] = workers
+        report["children_mb"] = max(workers)
+    else:
+        report["children_mb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return report
+
+
+def replay(session, records, speed=1., concurrency=16):
+    """
+        Replay recorded traffic against session and report latency per skill and overall, throughput and peak memory.
+        Queries are sent at their recorded time divided by speed without waiting for earlier responses,
+        except queries of the same session are sent after the previous one is answered.
+        Latency is measured from the scheduled send time, so time waiting for the previous query of
+        the same session or a free replay thread is counted, and a slow server is not hidden by sending less
+
+        Input:
+            - session: instance of ..module.interact_session.InteractSession or ..module.worker_pool.WorkerPool
+            - records: list of {"time", "session", "text"}, see TrafficRecorder
+            - speed: float, replay speed factor, 0 to send as fast as possible, default is 1
+            - concurrency: int, maximum queries running together, default is 16
+
+        Output:
+            - report dictionary
+    """
+    latencies = {}
+    errors = [0]
+    lock = threading.Lock()
+    previous = {}
+
+    def run(record, prev, scheduled):
+        if prev is not None:
+            prev.exception()
+        try:
+            topic = session(record["text"], session_id=record["session"], return_topic=True)[3]
+        except Exception:
+            with lock:
+                errors[0] += 1
+            return
+        latency = time.time() - scheduled
+        with lock:
+            latencies.setdefault(topic, []).append(latency)
+
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        t0 = records[0]["time"] if records else 0
+        for record in records:
+            if speed > 0:
+                scheduled = start_time + (record["time"] - t0) / speed
+                delay = scheduled - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                scheduled = time.time()
+            previous[record["session"]] = executor.submit(run, record, previous.get(record["session"], None), scheduled)
+    duration = time.time() - start_time
+
+    answered = sum(len(l) for l in latencies.values())
+    return {"queries": len(records),
+            "errors": errors[0],
+            "duration_s": duration,
+            "throughput_qps": answered / duration if duration > 0 else 0,
+            "latency": latency_summary(sum(latencies.values(), [])),
+            "skills": {str(topic): latency_summary(l) for topic, l in sorted(latencies.items(), key=lambda x: str(x[0]))},
+            "peak_rss": peak_rss(session)}
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+import json, itertools, collections
+from concurrent.futures import ThreadPoolExecutor
+
+'''
+    Author: Pengjia Zhu (zhupengjia@gmail.com)
+'''
+
+
+def read_dialogs(path, multi_turn=False):
+    """
+        read dialogs from file, yield (dialog_id, list of utterances)
+
+        Input:
+            - path: json lines file if ends with .jsonl or .json, each line is {"id": "123", "turns": ["hi", "bye"]},
+                {"id": "123", "text": "hi"} or a string. Otherwise text file with one utterance per line
+            - multi_turn: bool, for text file, utterances separated by blank lines are turns of one dialog,
+                default is False for one dialog per line
+    """
+    with open(path) as f:
+        if path.endswith(".jsonl") or path.endswith(".json"):
+            for i, line in enumerate(f):
+                if not line.strip():
+                    continue
+                d = json.loads(line)
+                if isinstance(d, str):
+                    yield str(i), [d]
+                elif "turns" in d:
+                    yield str(d.get("id", i)), [str(t) for t in d["turns"]]
+                else:
+                    yield str(d.get("id", i)), [str(d["text"])]
+        elif multi_turn:
+            dialog_ids, turns = itertools.count(), []
+            for line in f:
+                if line.strip():
+                    turns.append(line.strip())
+                elif turns:
+                    yield str(next(dialog_ids)), turns
+                    turns = []
+            if turns:
+                yield str(next(dialog_ids)), turns
+        else:
+            for i, line in enumerate(f):
+                if line.strip():
+                    yield str(i), [line.strip()]
+
+
+def _answer_chunk(session, chunk):
+    queries = [(text, session_id) for session_id, _, turns in chunk for text in turns]
+    try:
+        results = session.call_batch(queries, return_topic=True)
+    except Exception as err:
+        print("bulk batch error:", err)
+        results = _answer_each(session, chunk)
+    for session_id, _, _ in chunk:
+        session.reset(session_id)
+    return chunk, results
+
+
+def _answer_each(session, chunk):
+    """
+        answer queries of chunk one by one after the batch failed, failed queries get their exception as result
+    """
+    results = []
+    for session_id, _, turns in chunk:
+        # dialog could be changed by the failed batch
+        session.reset(session_id)
+        for text in turns:
+            try:
+                results.append(session.call_batch([(text, session_id)], return_topic=True)[0])
+            except Exception as err:
+                results.append(err)
+    return results
+
+
+def answer(session, dialogs, batch_size=64, concurrency=2):
+    """
+        answer dialogs in batches, yield dictionary of {"id", "turn", "text", "response", "score", "topic"}
+        in the same order of dialogs. Turns of one dialog are answered in order in the same batch,
+        several batches are answered concurrently, sessions are dropped after answered.
+        If a batch fails, its queries are answered one by one, failed queries get an empty response
+        with an extra "error" field
+
+        Input:
+            - session: instance of ..module.interact_session.InteractSession or ..module.worker_pool.WorkerPool
+            - dialogs: iterator of (dialog_id, list of utterances), see read_dialogs
+            - batch_size: int, minimum queries of each batch, default is 64
+            - concurrency: int, batches answered concurrently, default is 2
+    """
+    def chunks():
+        chunk, n = [], 0
+        for i, (dialog_id, turns) in enumerate(dialogs):
+            # dialog ids in input could be duplicated
+            chunk.append(("bulk-{}".format(i), dialog_id, turns))
+            n += len(turns)
+            if n >= batch_size:
+                yield chunk
+                chunk, n = [], 0
+        if chunk:
+            yield chunk
+
+    def rows(chunk, results):
+        results = iter(results)
+        for _, dialog_id, turns in chunk:
+            for turn, text in enumerate(turns):
+                result = next(results)
+                if isinstance(result, Exception):
+                    yield {"id": dialog_id, "turn": turn, "text": text, "response": None,
+                           "score": 0, "topic": None, "error": repr(result)}
+                    continue
+                _, response, score, topic = result
+                yield {"id": dialog_id, "turn": turn, "text": text, "response": response,
+                       "score": 0 if response is None else float(score), "topic": topic}
+
+    # batches are written out in order, at most 2 * concurrency batches are pending
+    pending = collections.deque()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for chunk in chunks():
+            pending.append(executor.submit(_answer_chunk, session, chunk))
+            while len(pending) >= concurrency * 2 or (pending and pending[0].done()):
+                yield from rows(*pending.popleft().result())
+        while pending:
+            yield from rows(*pending.popleft().result())
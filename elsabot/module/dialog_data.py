@@ -71,5 +71,21 @@ class DialogData(dict):
         """
         self = DialogData.dict_to_half(self)
 
+    def select(self, indices):
+        """
+            select dialogs from a batch of single turn dialogs, see ..module.dialog_status.status_collate
+
+            Input:
+                - indices: list of int, dialog indices in batch
+        """
+        data = DialogData({})
+        for k in self.keys():
+            if isinstance(self[k], PackedSequence):
+                data[k] = PackedSequence(self[k].data[indices],
+                                         torch.tensor([len(indices)]))
+            else:
+                data[k] = self[k][indices]
+        return data
+
 
 
@@ -8,6 +8,7 @@ from torch.nn.utils.rnn import pack_padded_sequence
 from nlptools.text.tokenizer import format_sentence
 from .entity_dict import EntityDict
 from .dialog_data import DialogData
+from .metrics import metrics
 
 
 def dialog_collate(batch):
@@ -40,10 +41,35 @@ def dialog_collate(batch):
     return data
 
 
+def status_collate(batch):
+    """
+        Collate function for a batch of single turn status,
+        each status is treated as a dialog with length 1
+
+        Input:
+            - batch: list of data generated from DialogStatus.data with one status
+    """
+    data = DialogData({})
+    keys = []
+    for b in batch:
+        keys += [k for k in b if k not in keys]
+    for k in keys:
+        values = [b[k] for b in batch if k in b]
+        if len(set(v.shape for v in values)) > 1:
+            # shape differs between dialogs, e.g. multiple choices of response ids, not needed for prediction
+            continue
+        values = [b[k] if k in b else numpy.zeros_like(values[0]) for b in batch]
+        tensor = torch.tensor(numpy.concatenate(values)).unsqueeze(1)
+        data[k] = pack_padded_sequence(tensor, [1]*tensor.size(0),
+                                       batch_first=True)
+    return data
+
+
 class DialogStatus:
     def __init__(self, vocab, tokenizer, ner, topic_manager,
                  sentiment_analyzer, spell_check=None, max_seq_len=100,
-                 max_entity_types=1024, rl_maxloop=20, rl_discount=0.95):
+                 max_entity_types=1024, rl_maxloop=20, rl_discount=0.95,
+                 keep_history=True):
         """
         Maintain the dialog status in a dialog
 
@@ -74,6 +100,7 @@ class DialogStatus:
             - spell_check: spell correction instance, default is None
             - max_seq_len: int, maximum sequence length
             - max_entity_types: int, maximum entity types
+            - keep_history: bool, save a copy of status to history_status after each response, default is True
 
         Special usage:
             - str(): print the current status
@@ -89,6 +116,7 @@ class DialogStatus:
         self.max_entity_types = max_entity_types
         self.rl_maxloop = rl_maxloop
         self.rl_discount = rl_discount
+        self.keep_history = keep_history
 
         self.current_status = self.__init_status()
         self.history_status = []
@@ -156,13 +184,14 @@ class DialogStatus:
     @classmethod
     def new_dialog(cls, vocab, tokenizer, ner, topic_manager,
                    sentiment_analyzer, spell_check=None, max_seq_len=100,
-                   max_entity_types=1024):
+                   max_entity_types=1024, keep_history=True):
         """
             create a new dialog
             data[k][tk] = data[k][tk].data
         """
         return cls(vocab, tokenizer, ner, topic_manager,
-                   sentiment_analyzer, spell_check, max_seq_len, max_entity_types)
+                   sentiment_analyzer, spell_check, max_seq_len, max_entity_types,
+                   keep_history=keep_history)
 
     @property
     def session(self):
@@ -199,13 +228,15 @@ class DialogStatus:
         utterance_raw = utterance.strip()
         
         # spell correction
-        utterance = self.spell_check(self.clean_text(utterance_raw)) if self.spell_check else utterance_raw
+        with metrics.timer("stage.spell_check"):
+            utterance = self.spell_check(self.clean_text(utterance_raw)) if self.spell_check else utterance_raw
         
         if len(utterance) < 1:
             return None
 
         # get sentiment
-        self.current_status["$SENTIMENT"] = self.sentiment_analyzer(utterance)
+        with metrics.timer("stage.sentiment_analyzer"):
+            self.current_status["$SENTIMENT"] = self.sentiment_analyzer(utterance)
 
         self.current_status["$UTTERANCE"] = utterance
         
@@ -213,7 +244,8 @@ class DialogStatus:
         if self.ner is None:
             utterance_replaced = utterance
         else:
-            entities, utterance_replaced = self.ner.get(utterance, return_dict=True)
+            with metrics.timer("stage.ner"):
+                entities, utterance_replaced = self.ner.get(utterance, return_dict=True)
             for e in entities:
                 # only keep first value
                 self.current_status[e] = entities[e][0]
@@ -223,10 +255,11 @@ class DialogStatus:
 
         # utterance to id
         #print("utterance", utterance_raw, utterance, utterance_replaced, entities, sep=" | ")
-        u_and_mask = format_sentence(utterance_replaced,
-                                vocab=self.vocab,
-                                tokenizer=self.tokenizer,
-                                max_seq_len=self.max_seq_len)
+        with metrics.timer("stage.format_sentence"):
+            u_and_mask = format_sentence(utterance_replaced,
+                                    vocab=self.vocab,
+                                    tokenizer=self.tokenizer,
+                                    max_seq_len=self.max_seq_len)
         if u_and_mask is None:
             return None
 
@@ -236,11 +269,30 @@ class DialogStatus:
         #self.current_status["entity"]["TOPIC"] = self.topic_manager.get_topic(self.current_status)
 
         # response mask
-        self.current_status = self.topic_manager.update_response_masks(
-            self.current_status)
+        with metrics.timer("stage.update_response_masks"):
+            self.current_status = self.topic_manager.update_response_masks(
+                self.current_status)
 
         return True
 
+    def early_dispatch(self, utterance):
+        """
+            answer command or message to redirected session before add_utterance, without spell check,
+            sentiment, NER and response masks
+
+            Input:
+                - utterance: string
+
+            Output:
+                - (response, score) if dispatched, otherwise None
+        """
+        with metrics.timer("stage.early_dispatch"):
+            status = self.topic_manager.early_dispatch(self.current_status, utterance.strip())
+        if status is None:
+            return None
+        self.current_status = status
+        return self.finish_response()
+
     def add_response(self, response):
         """
             add existed response, usually for training data
@@ -284,28 +336,70 @@ class DialogStatus:
                                             self.current_status,
                                             incre_state=incre_state,
                                             **args)
+        return self.finish_response()
+
+    @staticmethod
+    def get_response_batch(dialogs, response_sentiment=0, device="cpu", **args):
+        """
+            get responses for a batch of dialogs, the skill models run once for all dialogs
+
+            Input:
+                - dialogs: list of DialogStatus instance, utterances already added
+                - response_sentiment: wanted sentiment of response, default is 0
+                - device: "cpu" or "cuda:x"
+
+            Output:
+                - list of (response, score)
+        """
+        if not dialogs:
+            return []
+        for dialog in dialogs:
+            dialog.current_status["$RESPONSE_SENTIMENT"] = response_sentiment
+        current_data = status_collate([dialog.data(status_list=[dialog.current_status])
+                                       for dialog in dialogs])
+        current_data.to(device)
+        status_list = dialogs[0].topic_manager.get_response_batch(
+            current_data, [dialog.current_status for dialog in dialogs], **args)
+        for dialog, status in zip(dialogs, status_list):
+            dialog.current_status = status
+        return [dialog.finish_response() for dialog in dialogs]
+
+    def finish_response(self):
+        """
+            save the current response to history after the response is chosen
+        """
         self.current_status["$TIME"] = time.time()
         self.current_status["$HISTORY"].append([self.current_status["$TOPIC"], self.current_status["$UTTERANCE"], self.current_status["$RESPONSE"]])
         self.current_status["$HISTORY"] = self.current_status["$HISTORY"][-5:]
-        self.history_status.append(copy.deepcopy(self.current_status))
+        if self.keep_history:
+            self.history_status.append(copy.deepcopy(self.current_status))
         return self.current_status['$RESPONSE'], self.current_status['$RESPONSE_SCORE']
 
     def get_fallback(self, **args):
         self.current_status = self.topic_manager.get_fallback(self.current_status)
         return self.current_status['$RESPONSE'], self.current_status['$RESPONSE_SCORE']
 
+    def export_status(self, status=None):
+        """
+            export one turn
+
+            Input:
+                - status: status dictionary generated from this class,
+                    default is None for current status
+        """
+        if status is None:
+            status = self.current_status
+        return {"utterance": status['$UTTERANCE'],
+                "response": str(status['$RESPONSE']),
+                "time": status["$TIME"],
+                "session": str(status["$SESSION"]),
+                "topic": status["$TOPIC"]}
+
     def export_history(self):
         """
             dialog history export
         """
-        dialogs = []
-        for s in self.history_status:
-            dialogs.append({"utterance": s['$UTTERANCE'],
-                            "response": str(s['$RESPONSE']),
-                            "time": s["$TIME"],
-                            "session": str(s["$SESSION"]),
-                            "topic": s["$TOPIC"]})
-        return dialogs
+        return [self.export_status(s) for s in self.history_status]
 
     def __str__(self):
         """
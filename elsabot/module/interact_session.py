@@ -1,11 +1,23 @@
 #!/usr/bin/env python
-import torch, time, sqlite3, copy
+import os, torch, time, copy, threading, queue
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from nlptools.text.tokenizer import Tokenizer_BERT
 from nlptools.text.ner import NER
 from nlptools.text.sentiment import Sentiment
 from nlptools.text.spellcheck import SpellCorrection
-from .dialog_status import DialogStatus
+from .dialog_status import DialogStatus, status_collate
 from .topic_manager import TopicManager
+from .batch_scheduler import BatchScheduler
+from .session_store import SessionStore, SharedSessionStore
+from .session_state import SessionState
+from .log_writer import LogWriter
+from .metrics import metrics
+from .benchmark import TrafficRecorder
+from .session_lock import ShardedLock
+from .autotune import apply_profile
+from .shared_resources import SharedResources
+from .lazy_skill import LazySkill
 from .. import skills as Skills
 from ..reader import ReaderXLSX
 
@@ -19,7 +31,8 @@ class InteractSession:
     def __init__(self, vocab, tokenizer, ner, topic_manager,
                  sentiment_analyzer, spell_check=None, max_seq_len=100,
                  max_entity_types=512, device='cpu', timeout=300,
-                 log_db=None, log_table="log", **args):
+                 log_db=None, log_table="log", log_writer=None, scheduler=None,
+                 session_store=None, session_state=None, record_traffic=None, lock_shards=256, metrics_prefix="", **args):
         """
             General interact session
 
@@ -37,6 +50,19 @@ class InteractSession:
                 - timeout: int, seconds to session timeout
                 - log_db: sqlite db file for chat log saving, default is None
                 - log_table: sqlite db name for chat log saving
+                - log_writer: dictionary of chat log writer config, default is None for default parameters,
+                    see ..module.log_writer.LogWriter
+                - scheduler: dictionary of micro batching scheduler config, default is None to answer queries one by one,
+                    see ..module.batch_scheduler.BatchScheduler
+                - session_store: dictionary of session store config, default is None for default parameters,
+                    see ..module.session_store.SessionStore
+                - session_state: dictionary of out of process session state config, default is None to keep
+                    sessions in this process. Set it to let several workers serve the same sessions,
+                    see ..module.session_state.SessionState
+                - record_traffic: file to record queries for replay benchmark, default is None,
+                    see ..module.benchmark.TrafficRecorder
+                - lock_shards: int, number of locks serializing turns of the same session, default is 256
+                - metrics_prefix: string, prefix of gauge names, e.g. "tenant.NAME.", default is ""
         """
 
         super().__init__()
@@ -50,168 +76,670 @@ class InteractSession:
         self.max_seq_len = max_seq_len
         self.max_entity_types = max_entity_types
         self.timeout = timeout
-        self.dialog_status = {}
-        self.log_db = log_db
-        self.log_table = log_table
-        self._init_logdb()
-
-    def _get_cursor(self, dbfile):
-        db = sqlite3.connect(dbfile)
-        cursor = db.cursor()
-        return db, cursor
-
-    def _init_logdb(self):
-        if self.log_db:
-            db, cursor = self._get_cursor(self.log_db)
-            cmd = '''create table if not exists {} (
-                id integer primary key autoincrement,
-                session text,
-                time int,
-                topic text,
-                utterance text,
-                response text)'''.format(self.log_table)
-            cursor.execute(cmd)
-            db.commit()
-            db.close()
+        self.metrics_prefix = metrics_prefix
+        self.config = None # set by build, used to reload skills
+        self.recorder = TrafficRecorder(record_traffic) if record_traffic else None
+        self.session_locks = ShardedLock(lock_shards)
+        self.reader_ner_config = None
+        self.ready = threading.Event() # set after warmup
+        # skills are swapped when no turn is running
+        self.swap_condition = threading.Condition()
+        self.active_turns = 0
+        self.swap_pending = 0
+        log_writer = {} if log_writer is None else log_writer
+        self.log_writer = LogWriter(log_db, log_table, **log_writer) if log_db else None
+        session_store = {} if session_store is None else session_store
+        if session_state:
+            sweep_interval = session_store["sweep_interval"] if "sweep_interval" in session_store else 60
+            self.dialog_status = SharedSessionStore(SessionState(**session_state), self.new_dialog,
+                                                    ttl=timeout, sweep_interval=sweep_interval)
+        else:
+            self.dialog_status = SessionStore(ttl=timeout, **session_store)
+        self.scheduler = BatchScheduler(self.call_batch, **scheduler) if scheduler else None
+        metrics.gauge(metrics_prefix + "sessions", lambda: len(self.dialog_status))
+        if self.scheduler is not None:
+            metrics.gauge(metrics_prefix + "queue.scheduler", lambda: self.scheduler.queue.qsize())
+        if self.log_writer is not None:
+            metrics.gauge(metrics_prefix + "queue.log_writer", lambda: self.log_writer.queue.qsize())
 
     @classmethod
-    def build(cls, config):
+    def build(cls, config, shared=None, tenant=None):
         """
             construct session from config
 
             Input:
                 - config: configure dictionary
+                - shared: instance of ..module.shared_resources.SharedResources kept between builds, tokenizer,
+                    sentiment analyzer, spell correction, NER, embeddings and identical model weights are shared
+                    with other sessions built with it. Default is None
+                - tenant: string, tenant name used as prefix of gauges, default is None. Metrics of tenants are
+                    configured and reset by ..module.tenant_manager.TenantManager
         """
+        metrics_prefix = "tenant.{}.".format(tenant) if tenant else ""
+        if tenant is None and "metrics" in config:
+            metrics.configure(**config.metrics)
+        if "tune_profile" in config:
+            apply_profile(config, config.tune_profile)
+
+        # components with the same source are built only once
+        resources = SharedResources(parent=shared)
+
         # tokenizer and ner
-        tokenizer = Tokenizer_BERT(**config.tokenizer)
+        tokenizer = resources.shared.get_or_create(("tokenizer", resources.key(**config.tokenizer)),
+                                                   Tokenizer_BERT, **config.tokenizer)
         if "ner" in config:
             ner_config = config.ner
         else:
             ner_config = None
+        # readers are built concurrently, all use the original ner config
+        reader_ner_config = copy.deepcopy(ner_config)
         vocab = tokenizer.vocab
-        sentiment_analyzer = Sentiment()
-        spellcheck = SpellCorrection(**config.spell) if "spell" in config else None
-
-        shared_layers = {}
-
-        # skills
-        topic_manager = TopicManager()
-        for skill_name in config.skills:
-            response_params = copy.deepcopy(config.skills[skill_name])
-            if not hasattr(Skills, response_params.wrapper):
-                raise RuntimeError(
-                    "Error!! Skill {} not implemented!".format(
-                        config.skills[skill_name].wrapper))
-            skill_cls = getattr(Skills, response_params.wrapper)
-            if "dialogflow" in config.skills[skill_name]:
-                dialogflow = ReaderXLSX(response_params.dialogflow,
-                                        tokenizer=tokenizer,
-                                       ner_config=ner_config) 
-                entities = dialogflow.entities
-                response_params.pop('dialogflow')
-            else:
-                dialogflow = None
-                entities = None
-            response_params.pop('wrapper')
-
-            response = skill_cls(tokenizer=tokenizer, vocab=vocab,
-                                 dialogflow=dialogflow,
-                                 max_seq_len=config.model_general.max_seq_len,
-                                 skill_name=skill_name,
-                                 **response_params)
-            response.init_model(
-                shared_layers=shared_layers,
-                device=config.model_general.device,
-                **response_params)
-            response.eval() # set to eval mode
-            topic_manager.register(skill_name, response)
-
-            if ner_config is not None and entities is not None:
-                for k in ["keywords", "regex", "ner_name_replace"]:
-                    if entities[k]:
-                        if not k in ner_config:
-                            ner_config[k] = {}
-                        ner_config[k].update(entities[k])
-                for k in ["ner"]:
-                    if entities[k]:
-                        if not k in ner_config:
-                            ner_config[k] = []
-                        ner_config[k] += entities[k]
+
+        build_workers = config.build_workers if "build_workers" in config else 4
+        with ThreadPoolExecutor(max_workers=build_workers) as executor:
+            # independent components are loaded concurrently
+            sentiment_future = executor.submit(resources.shared.get_or_create, ("sentiment",), Sentiment)
+            spell_future = executor.submit(resources.shared.get_or_create, ("spell", resources.key(**config.spell)),
+                                           SpellCorrection, **config.spell) if "spell" in config else None
+            dialogflow_futures, entity_futures = {}, {}
+            for skill_name in config.skills:
+                skill_config = config.skills[skill_name]
+                if cls._is_lazy(skill_config):
+                    # only entities are needed by NER, the skill is loaded on first use
+                    if "dialogflow" in skill_config:
+                        entity_futures[skill_name] = executor.submit(ReaderXLSX.parse_entities, skill_config.dialogflow)
+                    continue
+                if "dialogflow" in skill_config:
+                    dialogflow_futures[skill_name] = executor.submit(
+                        resources.get_or_create,
+                        ("dialogflow", os.path.abspath(skill_config.dialogflow)),
+                        ReaderXLSX, skill_config.dialogflow,
+                        tokenizer=tokenizer, ner_config=reader_ner_config)
+                if "saved_model" in skill_config and os.path.exists(skill_config.saved_model):
+                    executor.submit(resources.checkpoint, skill_config.saved_model)
+
+            # skills
+            topic_manager = TopicManager()
+            for skill_name in config.skills:
+                if skill_name in dialogflow_futures:
+                    dialogflow = dialogflow_futures[skill_name].result()
+                    entities = dialogflow.entities
+                else:
+                    dialogflow = None
+                    entities = entity_futures[skill_name].result() if skill_name in entity_futures else None
+                if cls._is_lazy(config.skills[skill_name]):
+                    response = cls._lazy_skill(skill_name, config, tokenizer, reader_ner_config,
+                                               resources, dedupe=shared is not None, metrics_prefix=metrics_prefix)
+                else:
+                    response = cls._build_skill(skill_name, config, tokenizer, dialogflow, resources)
+                topic_manager.register(skill_name, response)
+
+                if ner_config is not None and entities is not None:
+                    for k in ["keywords", "regex", "ner_name_replace"]:
+                        if entities[k]:
+                            if not k in ner_config:
+                                ner_config[k] = {}
+                            ner_config[k].update(entities[k])
+                    for k in ["ner"]:
+                        if entities[k]:
+                            if not k in ner_config:
+                                ner_config[k] = []
+                            ner_config[k] += entities[k]
+
+            sentiment_analyzer = sentiment_future.result()
+            spellcheck = spell_future.result() if spell_future is not None else None
 
         if ner_config is not None:
-            ner = NER(**ner_config)
+            ner = resources.shared.get_or_create(("ner", resources.key(**ner_config)), NER, **ner_config)
         else:
             ner = None
 
-        return cls(vocab=vocab, tokenizer=tokenizer, ner=ner,
+        if shared is not None:
+            for skill in topic_manager.skills.values():
+                cls._dedupe_skill(skill, shared)
+
+        session = cls(vocab=vocab, tokenizer=tokenizer, ner=ner,
                    topic_manager=topic_manager,
                    sentiment_analyzer=sentiment_analyzer,
                    spell_check=spellcheck,
                    timeout=config.timeout if "timeout" in config else 300,
+                   scheduler=config.scheduler if "scheduler" in config else None,
+                   session_store=config.session_store if "session_store" in config else None,
+                   session_state=config.session_state if "session_state" in config else None,
+                   log_writer=config.log_writer if "log_writer" in config else None,
+                   record_traffic=config.record_traffic if "record_traffic" in config else None,
+                   metrics_prefix=metrics_prefix,
                    **config.model_general)
+        session.config = config
+        session.reader_ner_config = reader_ner_config
+
+        warmup = config.warmup if "warmup" in config else {}
+        if warmup is False:
+            session.ready.set()
+        else:
+            session.warmup(reset_metrics=tenant is None, **(warmup or {}))
+        return session
+
+    @staticmethod
+    def _build_skill(skill_name, config, tokenizer, dialogflow=None, shared_layers=None):
+        """
+            construct one skill from config
+
+            Input:
+                - skill_name: string
+                - config: configure dictionary
+                - tokenizer: instance of nlptools.text.Tokenizer
+                - dialogflow: instance of ..reader.ReaderXLSX, default is None
+                - shared_layers: dictionary, see ..module.shared_resources.SharedResources, default is None
+        """
+        response_params = copy.deepcopy(config.skills[skill_name])
+        if not hasattr(Skills, response_params.wrapper):
+            raise RuntimeError(
+                "Error!! Skill {} not implemented!".format(
+                    config.skills[skill_name].wrapper))
+        skill_cls = getattr(Skills, response_params.wrapper)
+        for k in ["dialogflow", "lazy", "idle_timeout"]:
+            if k in response_params:
+                response_params.pop(k)
+        response_params.pop('wrapper')
+
+        response = skill_cls(tokenizer=tokenizer, vocab=tokenizer.vocab,
+                             dialogflow=dialogflow,
+                             max_seq_len=config.model_general.max_seq_len,
+                             skill_name=skill_name,
+                             **response_params)
+        response.init_model(
+            shared_layers=shared_layers,
+            device=config.model_general.device,
+            **response_params)
+        response.eval() # set to eval mode
+        return response
+
+    @staticmethod
+    def _is_lazy(skill_config):
+        return "lazy" in skill_config and bool(skill_config["lazy"])
+
+    @staticmethod
+    def _dedupe_skill(skill, shared):
+        """
+            share identical weights of skill models with other tenants
+        """
+        for value in vars(skill).values():
+            if isinstance(value, torch.nn.Module):
+                shared.dedupe_parameters(value)
+
+    @classmethod
+    def _lazy_skill(cls, skill_name, config, tokenizer, reader_ner_config, shared_layers, dedupe=False, metrics_prefix=""):
+        """
+            construct a skill proxy loaded on first use and unloaded after idle, see ..module.lazy_skill.LazySkill
+
+            Input:
+                - skill_name: string
+                - config: configure dictionary, the skill config has "lazy: true" and optional "idle_timeout"
+                - tokenizer: instance of nlptools.text.Tokenizer
+                - reader_ner_config: ner config of dialogflow reader
+                - shared_layers: instance of ..module.shared_resources.SharedResources, only its shared resources such as
+                    embeddings are used, checkpoints and dialogflows of the skill are released when unloaded
+                - dedupe: bool, share identical weights via shared_layers.shared, default is False
+                - metrics_prefix: string, prefix of skill name in metrics, default is ""
+        """
+        skill_config = config.skills[skill_name]
+
+        def loader():
+            if "dialogflow" in skill_config:
+                dialogflow = ReaderXLSX(skill_config.dialogflow, tokenizer=tokenizer,
+                                        ner_config=copy.deepcopy(reader_ner_config))
+            else:
+                dialogflow = None
+            skill = cls._build_skill(skill_name, config, tokenizer, dialogflow,
+                                     SharedResources(parent=shared_layers.shared))
+            if dedupe:
+                cls._dedupe_skill(skill, shared_layers.shared)
+            return skill
+
+        return LazySkill(skill_name, loader,
+                         idle_timeout=skill_config["idle_timeout"] if "idle_timeout" in skill_config else 600,
+                         state_dir=config.skill_state_dir if "skill_state_dir" in config else None,
+                         metrics_name=metrics_prefix + skill_name)
+
+    def reload_skill(self, skill_name, config=None, background=True):
+        """
+            rebuild one skill with its checkpoint and dialogflow, then swap it into the topic manager
+            between turns. Live sessions are kept. The new skill doesn't share layers with other skills,
+            and entity changes in dialogflow need a full rebuild to update NER
+
+            Input:
+                - skill_name: string
+                - config: configure dictionary, default is None to use the one from build
+                - background: bool, reload in a background thread, default is True
+
+            Output:
+                - thread of reloading if background, otherwise None
+        """
+        config = self.config if config is None else config
+        if config is None or skill_name not in config.skills:
+            raise KeyError("Skill {} not existed in config".format(skill_name))
+
+        def reload():
+            with metrics.timer("reload.{}".format(skill_name)):
+                skill_config = config.skills[skill_name]
+                if "dialogflow" in skill_config:
+                    dialogflow = ReaderXLSX(skill_config.dialogflow,
+                                            tokenizer=self.tokenizer,
+                                            ner_config=copy.deepcopy(self.reader_ner_config))
+                else:
+                    dialogflow = None
+                if self._is_lazy(skill_config):
+                    # loaded again on next use
+                    response = self._lazy_skill(skill_name, config, self.tokenizer, self.reader_ner_config, SharedResources(),
+                                                metrics_prefix=self.metrics_prefix)
+                else:
+                    response = self._build_skill(skill_name, config, self.tokenizer, dialogflow, SharedResources())
+                self._swap_skill(skill_name, response)
+
+        if not background:
+            reload()
+            return None
+        thread = threading.Thread(target=reload, daemon=True)
+        thread.start()
+        return thread
+
+    @contextmanager
+    def _turn(self):
+        """
+            mark a running turn, wait while a skill swap is pending. Lazy skills used in the turn stay loaded
+        """
+        with self.swap_condition:
+            self.swap_condition.wait_for(lambda: self.swap_pending == 0)
+            self.active_turns += 1
+        try:
+            with LazySkill.pin_turn():
+                yield
+        finally:
+            with self.swap_condition:
+                self.active_turns -= 1
+                self.swap_condition.notify_all()
+
+    def _swap_skill(self, skill_name, skill):
+        """
+            replace skill after running turns are finished
+        """
+        with self.swap_condition:
+            self.swap_pending += 1
+            self.swap_condition.wait_for(lambda: self.active_turns == 0)
+            old = self.topic_manager.skills.get(skill_name, None)
+            if isinstance(old, LazySkill):
+                state_dir = old.close()
+                if isinstance(skill, LazySkill) and skill.state_dir is None:
+                    # learned state is restored by the new one
+                    skill.state_dir = state_dir
+            self.topic_manager.register(skill_name, skill)
+            self.swap_pending -= 1
+            self.swap_condition.notify_all()
+
+    def warmup(self, lengths=(4, 16, 64), batch_sizes=(1, 8), reset_metrics=True):
+        """
+            run synthetic utterances of several lengths from each skill through the whole pipeline before serving,
+            to grow memory allocators, select kernels and page in embeddings. Every skill predicts all
+            utterances, the sessions are not saved or logged. Metrics are cleared afterwards and ready is set
+
+            Input:
+                - lengths: list of int, number of words of utterances, capped by max_seq_len, default is (4, 16, 64)
+                - batch_sizes: list of int, batch sizes to run, default is (1, 8)
+                - reset_metrics: bool, clear metrics afterwards, False if metrics are shared with other sessions,
+                    default is True
+        """
+        start_time = time.time()
+        lengths = sorted(set(min(n, self.max_seq_len) for n in lengths))
+        utterances = []
+        # lazy skills are not loaded for warmup, remote skills are skipped
+        skills = {name: skill for name, skill in self.topic_manager.skills.items()
+                  if getattr(skill, "warmup", True)}
+        for skill in skills.values():
+            utterances += skill.warmup_utterances(lengths)
+
+        for batch_size in batch_sizes:
+            for i in range(0, len(utterances), batch_size):
+                dialogs = []
+                for j, utterance in enumerate(utterances[i:i+batch_size]):
+                    dialog = self.new_dialog("__warmup__{}".format(j))
+                    if dialog.add_utterance(utterance) is not None:
+                        dialogs.append(dialog)
+                if not dialogs:
+                    continue
+                current_data = status_collate([dialog.data(status_list=[dialog.current_status]) for dialog in dialogs])
+                current_data.to(self.device)
+                # the topic cascade stops at the first skill responded, so each skill is called directly
+                for skill_name, skill in skills.items():
+                    status_list = [copy.deepcopy(dialog.current_status) for dialog in dialogs]
+                    for status in status_list:
+                        status["$TOPIC"] = skill_name
+                    skill.get_response_batch(current_data, status_list, incre_state={})
+
+        # cold start latencies are not kept
+        if reset_metrics:
+            metrics.reset()
+        metrics.observe("warmup", time.time() - start_time)
+        self.ready.set()
+
+    def start(self, worker_id=None):
+        """
+            restart background threads and locks, used in forked worker processes after stop
+
+            Input:
+                - worker_id: int, index of worker process, chat logs of each worker are written to their own
+                    db file as {log_db}_worker{worker_id}, default is None to keep log_db
+        """
+        # locks may be held by other threads of parent process when forked
+        self.session_locks = ShardedLock(len(self.session_locks.locks))
+        self.swap_condition = threading.Condition()
+        self.active_turns = 0
+        self.swap_pending = 0
+        self.dialog_status.start()
+        if self.log_writer is not None:
+            if worker_id is not None:
+                root, ext = os.path.splitext(self.log_writer.log_db)
+                self.log_writer.log_db = "{}_worker{}{}".format(root, worker_id, ext)
+            self.log_writer.start()
+        if self.scheduler is not None:
+            self.scheduler.start()
+        for skill in self.topic_manager.skills.values():
+            if isinstance(skill, LazySkill):
+                skill.start()
+
+    def stop(self):
+        """
+            stop background threads, start runs them again. Used before forking worker processes.
+            Queries queued in scheduler get RuntimeError, queued chat logs are written
+        """
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        if self.log_writer is not None:
+            self.log_writer.stop()
+        self.dialog_status.stop()
+        for skill in self.topic_manager.skills.values():
+            if isinstance(skill, LazySkill):
+                skill.stop()
+
+    def close(self):
+        """
+            stop background threads before the session is dropped, states of lazy skills are saved
+        """
+        self.stop()
+        for skill in self.topic_manager.skills.values():
+            if isinstance(skill, LazySkill):
+                skill.close()
+
+    def __len__(self):
+        """
+            number of sessions
+        """
+        return len(self.dialog_status)
+
+    def metrics(self):
+        """
+            snapshot of serving metrics
+        """
+        return metrics.snapshot()
 
     def new_dialog(self, session_id):
         dialog = DialogStatus.new_dialog(self.vocab, self.tokenizer,
                                          self.ner, self.topic_manager,
                                          self.sentiment_analyzer,
                                          self.spell_check,
-                                         self.max_seq_len, self.max_entity_types)
+                                         self.max_seq_len, self.max_entity_types,
+                                         keep_history=False)
         dialog.current_status["$SESSION"] = session_id
         return dialog
 
-    def _save_log(self, session_id, dialog_status):
-        '''save log'''
-        if not self.log_db:
+    def _log_turn(self, dialog_status):
+        '''queue the current turn to chat log'''
+        if self.log_writer is None:
             return
-        db, cursor = self._get_cursor(self.log_db)
-        data = [(d["session"], d["time"], d["topic"], d["utterance"], d["response"]) for d in dialog_status.export_history()]
-        cursor.executemany("""insert into {} (session,time,topic,utterance,response) values (?,?,?,?,?)""".format(self.log_table), data)
-        db.commit()
-        db.close()
+        d = dialog_status.export_status()
+        self.log_writer.append(d["session"], d["time"], d["topic"], d["utterance"], d["response"])
 
     def reset(self, session_id):
         """
             reset the session for session_id
         """
-        if session_id in self.dialog_status:
-            del self.dialog_status[session_id]
+        with self.session_locks(session_id):
+            self.dialog_status.pop(session_id)
 
-    def __call__(self, query, session_id="default"):
+    def fallback(self, session_id):
         """
-            get response
+            degraded reply from the fallback of current topic without running skill models,
+            used when the service is overloaded. The session is not changed
 
             Input:
-                - query: string
-                - session_id: string, session id, default is "default"
+                - session_id: string
+        """
+        metrics.incr("fallback.overload")
+        dialog = self.dialog_status.get(session_id)
+        status = self.new_dialog(session_id).current_status
+        if dialog is not None:
+            status["$TOPIC"] = dialog.topic
+        skill = self.topic_manager.skills.get(status["$TOPIC"], None)
+        with LazySkill.pin_turn():
+            if isinstance(skill, LazySkill) and not skill.pin_loaded():
+                # skills are not loaded on the overload path
+                return session_id, None, 0
+            status = self.topic_manager.get_fallback(status)
+        if status is None:
+            return session_id, None, 0
+        return session_id, status["$RESPONSE"], status["$RESPONSE_SCORE"]
+
+    def _get_dialog(self, session_id):
+        """
+            get dialog status of session_id, create a new one if not existed or timeout
         """
+        dialog = self.dialog_status.get(session_id)
+
         #create new session for user
-        if session_id not in self.dialog_status:
-            self.dialog_status[session_id] = self.new_dialog(session_id)
+        if dialog is None:
+            dialog = self.new_dialog(session_id)
+            self.dialog_status[session_id] = dialog
 
         #timeout
-        if time.time() - self.dialog_status[session_id].last_time > self.timeout:
+        elif time.time() - dialog.last_time > self.timeout:
             # timeout reset
-            self._save_log(session_id, self.dialog_status[session_id])
-            self.dialog_status[session_id] = self.new_dialog(session_id)
+            dialog = self.new_dialog(session_id)
+            self.dialog_status[session_id] = dialog
+
+        return dialog
 
-        if len(query) < 1 or self.dialog_status[session_id].add_utterance(query) is None:
-            response, score = self.dialog_status[session_id].get_fallback()
-            return session_id, response, score
+    def _add_utterance(self, dialog, query, session_id):
+        """
+            add query to dialog status, return the fallback result if query can not be processed,
+            the result of command or redirected message dispatched without NLP pipeline, otherwise None
+        """
+        dialog.current_status["$SESSION"] = session_id
+        if len(query.strip()) > 0 and dialog.early_dispatch(query) is not None:
+            metrics.incr("early_dispatch")
+            return self._finish_turn(dialog, session_id)
+
+        if len(query) < 1 or dialog.add_utterance(query) is None:
+            metrics.incr("fallback.utterance")
+            response, score = dialog.get_fallback()
+            self.dialog_status[session_id] = dialog
+            return session_id, response, score, dialog.topic
 
         #reset SESSION
-        self.dialog_status[session_id].current_status["$SESSION"] = session_id
+        dialog.current_status["$SESSION"] = session_id
+        return None
+
+    def _finish_turn(self, dialog, session_id):
+        """
+            return (session_id, response, score, topic) after response is got
+        """
+        self._log_turn(dialog)
+        if dialog.current_status["$SESSION_RESET"]:
+            self.dialog_status.pop(session_id)
+            return session_id, "reset the session", 1, dialog.topic
+
+        # save the updated dialog status
+        self.dialog_status[session_id] = dialog
+
+        #update session_id
+        return dialog.session, dialog.current_status["$RESPONSE"],\
+                dialog.current_status["$RESPONSE_SCORE"], dialog.topic
 
-        #automatic response sentiment with period
-        response_sentiment = (int(time.time()%2419200)/2419200-0.5) * 0.6
+    @staticmethod
+    def _snapshot(dialog):
+        return copy.deepcopy(dialog.current_status), list(dialog.history_status)
 
-        response, score = self.dialog_status[session_id].get_response(response_sentiment=response_sentiment, device=self.device)
+    @staticmethod
+    def _restore(dialog, snapshot):
+        dialog.current_status = copy.deepcopy(snapshot[0])
+        dialog.history_status = list(snapshot[1])
 
-        if self.dialog_status[session_id].current_status["$SESSION_RESET"]:
-            self._save_log(session_id, self.dialog_status[session_id])
-            del self.dialog_status[session_id]
-            return session_id, "reset the session", 1
+    def _respond(self, queries, ids, dialogs, snapshots, results, response_sentiment,
+                 stream_callback=None, return_exceptions=False):
+        """
+            get responses of dialogs with utterances added, then finish their turns. If return_exceptions and
+            the batch failed, dialogs are restored to snapshots taken before the turn and answered one by one,
+            so only the failed queries get the exception. Nothing of the failed batch is saved or logged
+        """
+        try:
+            with metrics.timer("stage.get_response"):
+                DialogStatus.get_response_batch(dialogs, response_sentiment=response_sentiment,
+                                                device=self.device, stream_callback=stream_callback)
+        except Exception as err:
+            if not return_exceptions:
+                raise
+            for dialog, snapshot in zip(dialogs, snapshots):
+                self._restore(dialog, snapshot)
+            if len(dialogs) == 1:
+                results[ids[0]] = err
+                return
+            metrics.incr("batch_retry")
+            for i, dialog, snapshot in zip(ids, dialogs, snapshots):
+                query, session_id = queries[i]
+                try:
+                    results[i] = self._add_utterance(dialog, query, session_id)
+                except Exception as e:
+                    self._restore(dialog, snapshot)
+                    results[i] = e
+                    continue
+                if results[i] is None:
+                    self._respond(queries, [i], [dialog], [snapshot], results, response_sentiment,
+                                  stream_callback=stream_callback, return_exceptions=True)
+            return
+
+        for i, dialog in zip(ids, dialogs):
+            results[i] = self._finish_turn(dialog, queries[i][1])
+
+    def call_batch(self, queries, return_topic=False, stream_callback=None, return_exceptions=False):
+        """
+            get responses for a batch of queries, each skill model runs once for the whole batch.
+            Queries of the same session are answered in order
+
+            Input:
+                - queries: list of (query, session_id)
+                - return_topic: bool, also return the chosen topic of each query, default is False
+                - stream_callback: callable, called as stream_callback(current_status, text) with response
+                    text pieces from skills supporting streaming, default is None
+                - return_exceptions: bool, return the exception in place of the result of each failed query,
+                    other queries are still answered. Default is False to raise
+
+            Output:
+                - list of (session_id, response, score), or (session_id, response, score, topic) if return_topic
+        """
+        if self.recorder is not None:
+            self.recorder.record(queries)
+        metrics.start_trace(queries=queries)
+        start_time = time.time()
+        with self._turn():
+            results = [None] * len(queries)
+            remaining = list(range(len(queries)))
+            while len(remaining) > 0:
+                # one query per session in each round
+                batch, delayed, sessions = [], [], set()
+                for i in remaining:
+                    if queries[i][1] in sessions:
+                        delayed.append(i)
+                    else:
+                        sessions.add(queries[i][1])
+                        batch.append(i)
+                remaining = delayed
+
+                # dialogs of this round are locked until their turns are finished
+                with self.session_locks(*[queries[i][1] for i in batch]):
+                    ids, dialogs, snapshots = [], [], []
+                    for i in batch:
+                        query, session_id = queries[i]
+                        snapshot = None
+                        try:
+                            dialog = self._get_dialog(session_id)
+                            # dialog status is changed in place, restored if the turn failed
+                            snapshot = self._snapshot(dialog) if return_exceptions else None
+                            results[i] = self._add_utterance(dialog, query, session_id)
+                        except Exception as err:
+                            if not return_exceptions:
+                                raise
+                            if snapshot is not None:
+                                self._restore(dialog, snapshot)
+                            results[i] = err
+                            continue
+                        if results[i] is None:
+                            ids.append(i)
+                            dialogs.append(dialog)
+                            snapshots.append(snapshot)
+
+                    #automatic response sentiment with period
+                    response_sentiment = (int(time.time()%2419200)/2419200-0.5) * 0.6
+
+                    self._respond(queries, ids, dialogs, snapshots, results, response_sentiment,
+                                  stream_callback=stream_callback, return_exceptions=return_exceptions)
+
+        metrics.incr("turns", len(queries))
+        for _ in queries:
+            metrics.observe("turn", time.time() - start_time)
+        metrics.end_trace(results=results)
+
+        if return_topic:
+            return results
+        return [r if isinstance(r, Exception) else r[:3] for r in results]
+
+    def __call__(self, query, session_id="default", return_topic=False):
+        """
+            get response
+
+            Input:
+                - query: string
+                - session_id: string, session id, default is "default"
+                - return_topic: bool, also return the chosen topic, default is False
+        """
+        if self.scheduler is not None:
+            return self.scheduler(query, session_id, return_topic=return_topic)
+        return self.call_batch([(query, session_id)], return_topic=return_topic)[0]
+
+    def stream(self, query, session_id="default"):
+        """
+            get response as a generator. Yield ("token", text) for each response text piece settled by
+            streaming skills such as generative skill, then ("response", (session_id, response, score)).
+            The final response is complete and replaces the streamed text
+
+            Input:
+                - query: string
+                - session_id: string, session id, default is "default"
+        """
+        pieces = queue.Queue()
 
-        session_id = self.dialog_status[session_id].session #update session_id
-        return session_id, response, score
+        def run():
+            try:
+                result = self.call_batch([(query, session_id)],
+                                         stream_callback=lambda status, text: pieces.put(("token", text)))[0]
+                pieces.put(("response", result))
+            except Exception as err:
+                pieces.put(("error", err))
 
+        threading.Thread(target=run, daemon=True).start()
+        while True:
+            kind, value = pieces.get()
+            if kind == "error":
+                raise value
+            yield kind, value
+            if kind == "response":
+                break
 
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+import os, gc, time, pickle, tempfile, threading, numpy
+from contextlib import contextmanager
+from .dialog_status import status_collate
+from .metrics import metrics
+
+'''
+    Author: Pengjia Zhu (zhupengjia@gmail.com)
+'''
+
+
+class LazySkill:
+    turn = threading.local() # skills pinned by the running turn of each thread
+
+    def __init__(self, skill_name, loader, idle_timeout=600, sweep_interval=60, state_dir=None, metrics_name=None):
+        """
+            Proxy of a skill registered in ..module.topic_manager.TopicManager. The skill is built on first use and
+            dropped after idle_timeout seconds without use, its runtime state (see ..skills.skill_base.SkillBase.export_state)
+            is saved to state_dir and restored when it is built again.
+
+            Before the skill is loaded, its response mask is not calculated when utterance is added, it is calculated
+            and injected to status data when the skill is asked for response.
+
+            Skills used inside LazySkill.pin_turn are not unloaded by the sweeper until the block exits
+
+            Input:
+                - skill_name: string
+                - loader: function returns the built skill
+                - idle_timeout: int, seconds without use before unloaded, default is 600
+                - sweep_interval: int, seconds between two idle checks, default is 60, 0 to never unload
+                - state_dir: directory of saved skill states, default is None for a temporary directory
+                - metrics_name: name of skill in metrics, default is None for skill_name
+        """
+        self.skill_name = skill_name
+        self.loader = loader
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+        self.state_dir = state_dir
+        self.skill = None
+        self.last_used = 0
+        self.in_use = 0
+        self.metrics_name = skill_name if metrics_name is None else metrics_name
+        metrics.gauge("skill.{}.loaded".format(self.metrics_name), lambda: int(self.skill is not None))
+        self.start()
+
+    def start(self):
+        """
+            start the idle sweeper thread, used again in forked worker processes
+        """
+        self.lock = threading.RLock()
+        self.stopped = threading.Event()
+        self.thread = None
+        if self.sweep_interval:
+            self.thread = threading.Thread(target=self._sweep_loop, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """
+            stop the idle sweeper thread
+        """
+        self.stopped.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def _sweep_loop(self):
+        while not self.stopped.wait(self.sweep_interval):
+            with self.lock:
+                if self.skill is not None and self.in_use == 0 and time.time() - self.last_used > self.idle_timeout:
+                    self.unload()
+
+    @classmethod
+    @contextmanager
+    def pin_turn(cls):
+        """
+            lazy skills loaded in this thread inside the block are kept loaded until the block exits,
+            used around one turn so the skill is not swept between its response and update
+        """
+        if getattr(cls.turn, "skills", None) is not None:
+            # nested block, pinned by the outer one
+            yield
+            return
+        cls.turn.skills = pinned = []
+        try:
+            yield
+        finally:
+            cls.turn.skills = None
+            for skill in pinned:
+                skill._unpin()
+
+    def _pin(self):
+        pinned = getattr(self.turn, "skills", None)
+        if pinned is not None and self not in pinned:
+            self.in_use += 1
+            pinned.append(self)
+
+    def _unpin(self):
+        with self.lock:
+            self.in_use -= 1
+            self.last_used = time.time()
+
+    def pin_loaded(self):
+        """
+            pin the skill for the running turn if it is loaded, return False without loading otherwise
+        """
+        with self.lock:
+            if self.skill is None:
+                return False
+            self._pin()
+            return True
+
+    def close(self):
+        """
+            unload the skill and stop the sweeper, return directory of saved state
+        """
+        self.stop()
+        self.unload()
+        return self.state_dir
+
+    @property
+    def loaded(self):
+        return self.skill is not None
+
+    @property
+    def state_path(self):
+        if self.state_dir is None:
+            self.state_dir = tempfile.mkdtemp(prefix="elsa_skill_state_")
+        return os.path.join(self.state_dir, "{}.pkl".format(self.skill_name))
+
+    def load(self):
+        """
+            return the skill, build it if not loaded. Pinned if called inside LazySkill.pin_turn
+        """
+        with self.lock:
+            self.last_used = time.time()
+            self._pin()
+            if self.skill is None:
+                with metrics.timer("skill.{}.load".format(self.metrics_name)):
+                    skill = self.loader()
+                    if self.state_dir is not None and os.path.exists(self.state_path):
+                        with open(self.state_path, "rb") as f:
+                            skill.import_state(pickle.load(f))
+                self.skill = skill
+                metrics.incr("skill.{}.load".format(self.metrics_name))
+            return self.skill
+
+    def unload(self):
+        """
+            save state and drop the skill, running predictions keep their reference until finished
+        """
+        with self.lock:
+            if self.skill is None:
+                return
+            with metrics.timer("skill.{}.unload".format(self.metrics_name)):
+                state = self.skill.export_state()
+                if state is not None:
+                    path = self.state_path
+                    with open(path + ".tmp", "wb") as f:
+                        pickle.dump(state, f)
+                    os.replace(path + ".tmp", path)
+                self.skill = None
+                gc.collect()
+            metrics.incr("skill.{}.unload".format(self.metrics_name))
+
+    def _inject_masks(self, skill, status_data, status_list):
+        """
+            calculate response masks of status added before the skill was loaded
+        """
+        if all(status["$TENSOR_RESPONSE_MASK"].get(self.skill_name, None) is not None for status in status_list):
+            return
+        masks = []
+        for status in status_list:
+            mask = skill.update_mask(status)
+            status["$TENSOR_RESPONSE_MASK"][self.skill_name] = mask
+            masks.append(numpy.expand_dims(mask, axis=0) if isinstance(mask, numpy.ndarray) else numpy.array([[mask]]))
+        key = "$TENSOR_RESPONSE_MASK_" + self.skill_name
+        status_data[key] = status_collate([{key: mask} for mask in masks])[key]
+
+    def __getitem__(self, response):
+        return self.load()[response]
+
+    def update_mask(self, current_status):
+        """
+            response mask of the loaded skill, None if not loaded, calculated later when asked for response
+        """
+        skill = self.skill
+        if skill is None:
+            return None
+        return skill.update_mask(current_status)
+
+    def get_response(self, status_data, current_status=None, incre_state=None, **args):
+        return self.get_response_batch(status_data, [current_status], incre_state=incre_state, **args)[0]
+
+    def get_response_batch(self, status_data, status_list, incre_state=None, **args):
+        skill = self.load()
+        self._inject_masks(skill, status_data, status_list)
+        return skill.get_response_batch(status_data, status_list, incre_state=incre_state, **args)
+
+    def update_response(self, response, current_status):
+        return self.load().update_response(response, current_status)
+
+    def get_fallback(self, current_status):
+        return self.load().get_fallback(current_status)
+
+    @property
+    def warmup(self):
+        skill = self.skill
+        return skill is not None and getattr(skill, "warmup", True)
+
+    def warmup_utterances(self, lengths):
+        """
+            no warmup before loaded
+        """
+        return []
+
+    def export_state(self):
+        skill = self.skill
+        return None if skill is None else skill.export_state()
+
+    def import_state(self, state):
+        self.load().import_state(state)
+
+    def eval(self):
+        pass
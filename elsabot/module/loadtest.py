@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+import copy, time, json, random, threading, multiprocessing, requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from .benchmark import latency_summary
+
+'''
+    Author: Pengjia Zhu (zhupengjia@gmail.com)
+'''
+
+
+class StandInServer:
+    def __init__(self, latency=0.05, latency_std=0.02, latency_dist="normal", error_rate=0., port=0):
+        """
+            Local http server answering in the format of RestResponse skills, used for load test without network
+
+            Input:
+                - latency: float, mean seconds of response latency, default is 0.05
+                - latency_std: float, standard deviation of latency for normal distribution, default is 0.02
+                - latency_dist: "normal", "exponential" or "fixed", default is "normal"
+                - error_rate: float, ratio of responses with http 500, default is 0
+                - port: int, default is 0 for a free port
+        """
+        if latency_dist not in ["normal", "exponential", "fixed"]:
+            raise ValueError("latency_dist must be normal, exponential or fixed")
+        self.latency = latency
+        self.latency_std = latency_std
+        self.latency_dist = latency_dist
+        self.error_rate = error_rate
+        self.stats = {"requests": 0, "errors": 0}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self.url = "http://127.0.0.1:{}/".format(self.server.server_address[1])
+
+    def sample_latency(self):
+        if self.latency_dist == "fixed":
+            return self.latency
+        if self.latency_dist == "exponential":
+            return random.expovariate(1. / self.latency) if self.latency > 0 else 0
+        return max(0, random.gauss(self.latency, self.latency_std))
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                form = parse_qs(self.rfile.read(length).decode("utf-8"))
+                text = form.get("text", [""])[0]
+                time.sleep(stand_in.sample_latency())
+                error = random.random() < stand_in.error_rate
+                with stand_in.lock:
+                    stand_in.stats["requests"] += 1
+                    stand_in.stats["errors"] += int(error)
+                if error:
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+                body = json.dumps({"data": {"response": "stand-in: " + text, "score": 1}}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        """
+            serve in a background thread
+        """
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def patch_rest_skills(config, url):
+    """
+        point all RestResponse skills of config to url, return the patched copy of config
+
+        Input:
+            - config: configure dictionary
+            - url: string
+    """
+    config = copy.deepcopy(config)
+    for skill_name in config["skills"]:
+        if config["skills"][skill_name]["wrapper"] == "RestResponse":
+            config["skills"][skill_name]["rest_url"] = url
+    return config
+
+
+def _serve(config, backend_config):
+    from ..backend import Backend
+    Backend(config, **backend_config).run()
+
+
+def start_backend(config, backend_config, timeout=600):
+    """
+        run backend in a forked process, return the process after health check passed
+
+        Input:
+            - config: configure dictionary of session
+            - backend_config: dictionary of backend parameters, must be restful or restful_async
+            - timeout: seconds to wait for backend ready, default is 600
+    """
+    process = multiprocessing.get_context("fork").Process(target=_serve, args=(config, backend_config), daemon=True)
+    process.start()
+    health_url = "http://127.0.0.1:{}{}".format(backend_config["port"], backend_config.get("health_rule", "/health"))
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if not process.is_alive():
+            raise RuntimeError("backend exited with code {}".format(process.exitcode))
+        try:
+            if requests.get(health_url, timeout=1).status_code == 200:
+                return process
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("backend not ready in {} seconds".format(timeout))
+
+
+def load_level(url, concurrency, duration=10, turns=5, texts=None):
+    """
+        closed loop load with synthetic sessions, each client sends the next query after the previous response
+
+        Input:
+            - url: query url of rest backend
+            - concurrency: int, number of concurrent clients
+            - duration: float, seconds of load, default is 10
+            - turns: int, queries of each synthetic session, default is 5
+            - texts: list of query texts, default is None for some greetings
+
+        Output:
+            - dictionary of throughput and latency
+    """
+    texts = texts or ["hello", "how are you", "what can you do", "tell me a joke", "thank you", "bye"]
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client(client_id):
+        http = requests.Session()
+        n = 0
+        while time.time() < deadline:
+            session_id = "load-{}-{}-{}".format(concurrency, client_id, n // turns)
+            start = time.time()
+            try:
+                ok = http.post(url, data={"text": random.choice(texts), "sessionId": session_id}, timeout=60).status_code == 200
+            except requests.exceptions.RequestException:
+                ok = False
+            with lock:
+                if ok:
+                    latencies.append(time.time() - start)
+                else:
+                    errors[0] += 1
+            n += 1
+
+    start_time = time.time()
+    clients = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(concurrency)]
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join()
+    elapsed = time.time() - start_time
+    return {"concurrency": concurrency,
+            "throughput_qps": len(latencies) / elapsed,
+            "errors": errors[0],
+            "latency": latency_summary(latencies)}
+
+
+def sweep(url, levels=(1, 2, 4, 8, 16, 32, 64), duration=10, turns=5, texts=None):
+    """
+        run load_level for each concurrency level, return throughput and latency curves and saturation throughput
+    """
+    curve = []
+    for concurrency in levels:
+        result = load_level(url, concurrency, duration=duration, turns=turns, texts=texts)
+        print(json.dumps(result))
+        curve.append(result)
+    best = max(curve, key=lambda r: r["throughput_qps"])
+    return {"saturation_qps": best["throughput_qps"],
+            "saturation_concurrency": best["concurrency"],
+            "curve": curve}
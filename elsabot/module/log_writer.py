@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+import time, queue, sqlite3, threading, atexit
+
+'''
+    Author: Pengjia Zhu (zhupengjia@gmail.com)
+'''
+
+
+class LogWriter:
+    def __init__(self, log_db, log_table="log", batch_size=500, flush_interval=1, max_rows=1000000):
+        """
+            Background chat log writer. Each turn is queued when it happens, and written
+            in batches over one persistent WAL mode sqlite connection.
+            The table is renamed to {log_table}_{timestamp} once it grows beyond max_rows
+
+            Input:
+                - log_db: sqlite db file
+                - log_table: table name, default is "log"
+                - batch_size: int, maximum rows in one insert, default is 500
+                - flush_interval: float, maximum seconds a turn waits in queue, default is 1
+                - max_rows: int, rows before the table is rolled over, default is 1000000
+        """
+        self.log_db = log_db
+        self.log_table = log_table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.start()
+
+    def start(self):
+        """
+            start the writer thread
+        """
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def stop(self, timeout=10):
+        """
+            write all queued turns and stop the writer thread
+
+            Input:
+                - timeout: float, seconds to wait for the writer, default is 10
+        """
+        atexit.unregister(self.flush)
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout)
+
+    def append(self, session, time, topic, utterance, response):
+        """
+            queue one turn
+        """
+        self.queue.put((session, time, topic, utterance, response))
+
+    def flush(self):
+        """
+            block until all queued turns are written
+        """
+        if self.thread.is_alive():
+            self.queue.join()
+
+    def _create_table(self, cursor):
+        cmd = '''create table if not exists {} (
+            id integer primary key autoincrement,
+            session text,
+            time int,
+            topic text,
+            utterance text,
+            response text)'''.format(self.log_table)
+        cursor.execute(cmd)
+        return cursor.execute("select count(*) from {}".format(self.log_table)).fetchone()[0]
+
+    def _rollover(self, db):
+        cursor = db.cursor()
+        suffix = int(time.time())
+        while cursor.execute("select 1 from sqlite_master where name=?",
+                             ("{}_{}".format(self.log_table, suffix),)).fetchone():
+            suffix += 1
+        cursor.execute("alter table {} rename to {}_{}".format(self.log_table, self.log_table, suffix))
+        rows = self._create_table(cursor)
+        db.commit()
+        return rows
+
+    def _collect(self):
+        rows = [self.queue.get()]
+        deadline = time.time() + self.flush_interval
+        # None is queued by stop
+        while len(rows) < self.batch_size and rows[-1] is not None:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                rows.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return rows
+
+    def _loop(self):
+        db = sqlite3.connect(self.log_db, timeout=30)
+        db.execute("pragma journal_mode=wal")
+        db.execute("pragma synchronous=normal")
+        n_rows = self._create_table(db.cursor())
+        db.commit()
+        stopped = False
+        while not stopped:
+            rows = self._collect()
+            stopped = rows[-1] is None
+            data = [row for row in rows if row is not None]
+            try:
+                if data:
+                    db.executemany("insert into {} (session,time,topic,utterance,response) values (?,?,?,?,?)".format(self.log_table), data)
+                    db.commit()
+                    n_rows += len(data)
+                if n_rows >= self.max_rows:
+                    n_rows = self._rollover(db)
+            except Exception as err:
+                print("chat log error:", err)
+            for _ in rows:
+                self.queue.task_done()
+        db.close()
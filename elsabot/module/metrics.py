@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+import os, time, json, bisect, threading
+from contextlib import contextmanager
+
+'''
+    Author: Pengjia Zhu (zhupengjia@gmail.com)
+'''
+
+
+class Histogram:
+    # upper bounds of buckets in milliseconds
+    buckets = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, float("inf")]
+
+    def __init__(self):
+        """
+            Latency histogram with fixed buckets
+        """
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, p):
+        """
+            upper bound of bucket containing the p percentile
+
+            Input:
+                - p: float between 0 and 100
+        """
+        if self.count < 1:
+            return 0
+        rank, n = self.count * p / 100., 0
+        for bound, c in zip(self.buckets, self.counts):
+            n += c
+            if n >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {"count": self.count,
+                "mean_ms": self.total / self.count if self.count else 0,
+                "p50_ms": self.percentile(50),
+                "p95_ms": self.percentile(95),
+                "p99_ms": self.percentile(99),
+                "max_ms": self.max}
+
+
+class Metrics:
+    def __init__(self):
+        """
+            Latency histograms, counters and gauges of the serving pipeline
+
+            Special usage:
+                - with metrics.timer(name): record the latency of the block
+        """
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.trace_file = None
+
+    def _after_fork(self):
+        # the lock may be held by another thread of parent process when forked
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def configure(self, trace_file=None, **args):
+        """
+            Input:
+                - trace_file: file to append per request trace as json lines, default is None
+        """
+        if trace_file:
+            self.trace_file = open(trace_file, "a", buffering=1)
+
+    def observe(self, name, seconds):
+        """
+            record a latency
+
+            Input:
+                - name: string, stage name
+                - seconds: float
+        """
+        ms = seconds * 1000
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(ms)
+        trace = getattr(self.local, "trace", None)
+        if trace is not None:
+            trace["stages"].append([name, round(ms, 3)])
+
+    @contextmanager
+    def timer(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start)
+
+    def incr(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, func):
+        """
+            register a gauge, e.g. queue depth
+
+            Input:
+                - name: string
+                - func: function returns the current value
+        """
+        self.gauges[name] = func
+
+    def reset(self):
+        """
+            clear histograms and counters, gauges are kept
+        """
+        with self.lock:
+            self.histograms = {}
+            self.counters = {}
+
+    def start_trace(self, **info):
+        """
+            start the trace of current thread if trace_file is set
+        """
+        if self.trace_file is not None:
+            self.local.trace = {"time": time.time(), "stages": [], **info}
+
+    def end_trace(self, **info):
+        """
+            write the trace of current thread to trace_file
+        """
+        trace = getattr(self.local, "trace", None)
+        if trace is None:
+            return
+        self.local.trace = None
+        trace.update(info)
+        trace["total_ms"] = round((time.time() - trace["time"]) * 1000, 3)
+        with self.lock:
+            self.trace_file.write(json.dumps(trace, default=str) + "\n")
+
+    def snapshot(self):
+        """
+            return all metrics as dictionary
+        """
+        with self.lock:
+            data = {"latency": {k: v.to_dict() for k, v in self.histograms.items()},
+                    "counters": dict(self.counters)}
+        data["gauges"] = {}
+        for k, func in list(self.gauges.items()):
+            try:
+                data["gauges"][k] = func()
+            except Exception:
+                data["gauges"][k] = None
+        turns = data["counters"].get("turns", 0)
+        data["fallback_rate"] = {k[9:]: v / turns for k, v in data["counters"].items()
+                                 if k.startswith("fallback.") and turns > 0}
+        return data
+
+
+metrics = Metrics()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=metrics._after_fork)
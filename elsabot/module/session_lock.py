@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+import zlib, threading
+from contextlib import contextmanager
+
+'''
+    Author: Pengjia Zhu (zhupengjia@gmail.com)
+'''
+
+
+class ShardedLock:
+    def __init__(self, shards=256):
+        """
+            Fixed table of locks, each session id is hashed to one of them. Turns of different sessions
+            run concurrently, turns of the same session one by one
+
+            Special usage:
+                - with lock(session_id, ...): hold locks of all session ids, locks are taken in order to avoid deadlock
+
+            Input:
+                - shards: int, number of locks, default is 256
+        """
+        self.locks = [threading.RLock() for _ in range(shards)]
+
+    def shard(self, session_id):
+        """
+            lock index of session_id
+        """
+        return zlib.crc32(str(session_id).encode("utf-8")) % len(self.locks)
+
+    @contextmanager
+    def __call__(self, *session_ids):
+        shards = sorted(set(self.shard(s) for s in session_ids))
+        for i in shards:
+            self.locks[i].acquire()
+        try:
+            yield
+        finally:
+            for i in reversed(shards):
+                self.locks[i].release()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+import os, time, json, base64, struct, sqlite3, threading, numpy, torch
+
+'''
+    Author: Pengjia Zhu (zhupengjia@gmail.com)
+
+    Out of process storage of dialog status, so any worker process can continue any session
+'''
+
+
+class PackedBits:
+    def __init__(self, array):
+        """
+            bit packed numpy array, used for boolean masks
+
+            Input:
+                - array: numpy array with only 0 and 1
+        """
+        self.shape = array.shape
+        self.dtype = array.dtype.str
+        self.bits = numpy.packbits(array.astype("bool_").reshape(-1)).tobytes()
+
+    def unpack(self):
+        size = int(numpy.prod(self.shape))
+        bits = numpy.unpackbits(numpy.frombuffer(self.bits, "uint8"), count=size)
+        return bits.astype(self.dtype).reshape(self.shape)
+
+
+def _pack(value):
+    if isinstance(value, torch.Tensor):
+        value = value.detach().cpu().numpy()
+    if isinstance(value, numpy.ndarray):
+        if value.dtype == numpy.bool_ or (value.size > 8 and value.dtype.kind in "fiu"
+                                          and numpy.isin(value, (0, 1)).all()):
+            return PackedBits(value)
+        return value
+    if isinstance(value, dict):
+        return {k: _pack(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_pack(v) for v in value]
+    return value
+
+
+def _unpack(value):
+    if isinstance(value, PackedBits):
+        return value.unpack()
+    if isinstance(value, dict):
+        return {k: _unpack(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_unpack(v) for v in value]
+    return value
+
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+def _encode(value):
+    """
+        convert value to json types, numpy arrays and other containers are tagged
+    """
+    if isinstance(value, PackedBits):
+        return {"__bits__": _b64(value.bits), "shape": list(value.shape), "dtype": value.dtype}
+    if isinstance(value, (numpy.ndarray, numpy.generic)):
+        array = numpy.asarray(value)
+        if array.dtype.kind == "O":
+            raise TypeError("object array can not be saved in session state")
+        return {"__ndarray__": _b64(array.tobytes()), "shape": list(array.shape), "dtype": array.dtype.str,
+                "scalar": isinstance(value, numpy.generic)}
+    if isinstance(value, dict):
+        if all(isinstance(k, str) for k in value):
+            return {k: _encode(v) for k, v in value.items()}
+        return {"__items__": [[_encode(k), _encode(v)] for k, v in value.items()]}
+    if isinstance(value, tuple):
+        return {"__tuple__": [_encode(v) for v in value]}
+    if isinstance(value, (set, frozenset)):
+        return {"__set__": [_encode(v) for v in value]}
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    raise TypeError("{} can not be saved in session state".format(type(value)))
+
+
+def _decode(value):
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    if not isinstance(value, dict):
+        return value
+    if "__bits__" in value:
+        bits = PackedBits.__new__(PackedBits)
+        bits.shape = tuple(value["shape"])
+        bits.dtype = numpy.dtype(value["dtype"]).str
+        bits.bits = base64.b64decode(value["__bits__"])
+        return bits
+    if "__ndarray__" in value:
+        dtype = numpy.dtype(value["dtype"])
+        if dtype.kind == "O":
+            raise ValueError("object array in session state")
+        array = numpy.frombuffer(base64.b64decode(value["__ndarray__"]), dtype).reshape(value["shape"]).copy()
+        return array[()] if value["scalar"] else array
+    if "__items__" in value:
+        return {_decode(k): _decode(v) for k, v in value["__items__"]}
+    if "__tuple__" in value:
+        return tuple(_decode(v) for v in value["__tuple__"])
+    if "__set__" in value:
+        return set(_decode(v) for v in value["__set__"])
+    return {k: _decode(v) for k, v in value.items()}
+
+
+def dump_status(current_status):
+    """
+        serialize current_status of dialog status to json bytes, no pickle so data from a shared db can not
+        execute code when loaded. Tensors are saved as numpy arrays, masks are bit packed
+
+        Input:
+            - current_status: dictionary of status, generated from dialog_status module
+    """
+    return json.dumps(_encode(_pack(current_status)), separators=(",", ":")).encode("utf-8")
+
+
+def load_status(data):
+    """
+        deserialize current_status from bytes generated by dump_status, raise ValueError if invalid
+    """
+    return _unpack(_decode(json.loads(bytes(data).decode("utf-8"))))
+
+
+class SessionStateSQLite:
+    def __init__(self, path, table="session_state", **args):
+        """
+            Session state saved in sqlite db
+
+            Input:
+                - path: sqlite db file
+                - table: table name, default is "session_state"
+        """
+        self.path = path
+        self.table = table
+        self.local = threading.local()
+        db = sqlite3.connect(self.path, timeout=30)
+        db.execute('''create table if not exists {} (
+            session text primary key,
+            time real,
+            status blob,
+            version integer default 0)'''.format(self.table))
+        columns = [row[1] for row in db.execute("pragma table_info({})".format(self.table))]
+        if "version" not in columns:
+            db.execute("alter table {} add column version integer default 0".format(self.table))
+        db.commit()
+        db.close()
+
+    def _get_db(self):
+        # one connection per thread, transactions are started explicitly
+        if not hasattr(self.local, "db"):
+            self.local.db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self.local.db.execute("pragma journal_mode=wal")
+            self.local.db.execute("pragma synchronous=normal")
+        return self.local.db
+
+    def load(self, session_id):
+        """
+            return (current_status, version) of session_id, None if not existed or invalid
+        """
+        row = self._get_db().execute("select status, version from {} where session=?".format(self.table),
+                                     (str(session_id),)).fetchone()
+        if row is None:
+            return None
+        try:
+            return load_status(row[0]), row[1] or 0
+        except ValueError:
+            # e.g. saved by an older version
+            return None
+
+    def save(self, session_id, current_status, version=None):
+        """
+            save current_status if the saved version is still version, return the new version, None if changed
+            by others
+
+            Input:
+                - session_id: string
+                - current_status: dictionary of status
+                - version: int, version returned by load, 0 for a session not saved, default is None to overwrite
+        """
+        data = sqlite3.Binary(dump_status(current_status))
+        db = self._get_db()
+        db.execute("begin immediate")
+        try:
+            row = db.execute("select version from {} where session=?".format(self.table),
+                             (str(session_id),)).fetchone()
+            current = (row[0] or 0) if row is not None else 0
+            if version is not None and version != current:
+                db.execute("rollback")
+                return None
+            db.execute("insert or replace into {} (session, time, status, version) values (?,?,?,?)".format(self.table),
+                       (str(session_id), time.time(), data, current + 1))
+            db.execute("commit")
+        except Exception:
+            db.execute("rollback")
+            raise
+        return current + 1
+
+    def delete(self, session_id):
+        db = self._get_db()
+        db.execute("delete from {} where session=?".format(self.table), (str(session_id),))
+        db.commit()
+
+    def __len__(self):
+        return self._get_db().execute("select count(*) from {}".format(self.table)).fetchone()[0]
+
+    def sweep(self, expire_time):
+        """
+            delete sessions not saved since expire_time, return number of deleted sessions
+        """
+        db = self._get_db()
+        n = db.execute("delete from {} where time<?".format(self.table), (expire_time,)).rowcount
+        db.commit()
+        return n
+
+
+class SessionStateLMDB:
+    def __init__(self, path, map_size=1<<30, **args):
+        """
+            Session state saved in lmdb
+
+            Input:
+                - path: lmdb directory
+                - map_size: int, maximum size of db, default is 1GB
+        """
+        self.path = path
+        self.map_size = map_size
+        self.pid = None
+        self._env = None
+
+    @property
+    def env(self):
+        # lmdb environment can not be used across fork, opened once in each process
+        if self.pid != os.getpid():
+            import lmdb
+            self._env = lmdb.open(self.path, map_size=self.map_size, max_dbs=0)
+            self.pid = os.getpid()
+        return self._env
+
+    def load(self, session_id):
+        """
+            return (current_status, version) of session_id, None if not existed or invalid
+        """
+        with self.env.begin() as txn:
+            data = txn.get(str(session_id).encode("utf-8"))
+        if data is None:
+            return None
+        try:
+            return load_status(data[16:]), struct.unpack("dq", data[:16])[1]
+        except (ValueError, struct.error):
+            # e.g. saved by an older version
+            return None
+
+    def save(self, session_id, current_status, version=None):
+        """
+            save current_status if the saved version is still version, return the new version, None if changed
+            by others. see SessionStateSQLite.save
+        """
+        key = str(session_id).encode("utf-8")
+        data = dump_status(current_status)
+        # write transactions of lmdb are serialized between processes
+        with self.env.begin(write=True) as txn:
+            old = txn.get(key)
+            current = struct.unpack("dq", old[:16])[1] if old is not None and len(old) >= 16 else 0
+            if version is not None and version != current:
+                return None
+            # saved time and version are prepended to the status
+            txn.put(key, struct.pack("dq", time.time(), current + 1) + data)
+        return current + 1
+
+    def delete(self, session_id):
+        with self.env.begin(write=True) as txn:
+            txn.delete(str(session_id).encode("utf-8"))
+
+    def __len__(self):
+        return self.env.stat()["entries"]
+
+    def sweep(self, expire_time):
+        n = 0
+        with self.env.begin(write=True) as txn:
+            for key, value in txn.cursor():
+                if struct.unpack("d", value[:8])[0] < expire_time:
+                    txn.delete(key)
+                    n += 1
+        return n
+
+
+class SessionState:
+    def __new__(cls, backend="sqlite", **args):
+        """
+            Session state backend
+
+            Input:
+                - backend: "sqlite" or "lmdb", default is "sqlite"
+                - see SessionStateSQLite and SessionStateLMDB for other parameters
+        """
+        if backend == "lmdb":
+            return SessionStateLMDB(**args)
+        return SessionStateSQLite(**args)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+import time, threading
+from collections import OrderedDict
+from .metrics import metrics
+
+'''
+    Author: Pengjia Zhu (zhupengjia@gmail.com)
+'''
+
+
+class SessionStore:
+    def __init__(self, max_sessions=10000, ttl=300, sweep_interval=60):
+        """
+            Bounded store of dialog status. The least recently used session is evicted
+            when the store is full, expired sessions are evicted by a background sweeper
+
+            Input:
+                - max_sessions: int, maximum number of sessions, default is 10000
+                - ttl: int, seconds of idle time before a session expires, default is 300
+                - sweep_interval: int, seconds between two sweeps, default is 60, 0 to disable the sweeper
+        """
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.sessions = OrderedDict()
+        self.start()
+
+    def start(self):
+        """
+            start the sweeper thread
+        """
+        self.lock = threading.RLock()
+        self.stopped = threading.Event()
+        self.thread = None
+        if self.sweep_interval:
+            self.thread = threading.Thread(target=self._sweep_loop, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """
+            stop the sweeper thread
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __contains__(self, session_id):
+        return session_id in self.sessions
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def get(self, session_id, default=None):
+        """
+            get dialog status and mark the session as recently used
+        """
+        with self.lock:
+            if session_id not in self.sessions:
+                return default
+            self.sessions.move_to_end(session_id)
+            self.sessions[session_id][1] = time.time()
+            return self.sessions[session_id][0]
+
+    def __getitem__(self, session_id):
+        if session_id not in self.sessions:
+            raise KeyError(session_id)
+        return self.get(session_id)
+
+    def __setitem__(self, session_id, dialog_status):
+        n = 0
+        with self.lock:
+            self.sessions[session_id] = [dialog_status, time.time()]
+            self.sessions.move_to_end(session_id)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                n += 1
+        if n > 0:
+            metrics.incr("sessions.evicted.lru", n)
+
+    def pop(self, session_id, default=None):
+        with self.lock:
+            if session_id not in self.sessions:
+                return default
+            return self.sessions.pop(session_id)[0]
+
+    def __delitem__(self, session_id):
+        with self.lock:
+            del self.sessions[session_id]
+
+    def sweep(self):
+        """
+            evict expired sessions
+        """
+        n = 0
+        expire_time = time.time() - self.ttl
+        with self.lock:
+            # sessions are ordered by access time
+            while len(self.sessions) > 0:
+                session_id, (dialog_status, access_time) = next(iter(self.sessions.items()))
+                if access_time > expire_time:
+                    break
+                self.sessions.popitem(last=False)
+                n += 1
+        if n > 0:
+            metrics.incr("sessions.evicted.ttl", n)
+        return n
+
+    def _sweep_loop(self):
+        while not self.stopped.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception as err:
+                print("session sweep error:", err)
+
+
+class SharedSessionStore:
+    def __init__(self, state, new_dialog, ttl=300, sweep_interval=60):
+        """
+            Dialog status store saved out of process, so several workers can serve the same sessions.
+            The dialog status is loaded on each get and saved on each set.
+
+            A session is meant to be served by one process at a time, e.g. via session affinity of
+            ..module.worker_pool.WorkerPool. Saving is compare-and-swap on the version loaded with the dialog status,
+            if another process saved the session in between, RuntimeError is raised instead of losing its update
+
+            Input:
+                - state: session state backend, see ..module.session_state
+                - new_dialog: function to create an empty dialog status from session_id
+                - ttl: int, seconds of idle time before a session expires, default is 300
+                - sweep_interval: int, seconds between two sweeps, default is 60, 0 to disable the sweeper
+        """
+        self.state = state
+        self.new_dialog = new_dialog
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.start()
+
+    def start(self):
+        """
+            start the sweeper thread
+        """
+        self.stopped = threading.Event()
+        self.thread = None
+        if self.sweep_interval:
+            self.thread = threading.Thread(target=self._sweep_loop, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """
+            stop the sweeper thread
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __contains__(self, session_id):
+        return self.state.load(session_id) is not None
+
+    def __len__(self):
+        return len(self.state)
+
+    def get(self, session_id, default=None):
+        loaded = self.state.load(session_id)
+        if loaded is None:
+            return default
+        dialog_status = self.new_dialog(session_id)
+        dialog_status.current_status, dialog_status.state_version = loaded
+        return dialog_status
+
+    def __getitem__(self, session_id):
+        dialog_status = self.get(session_id)
+        if dialog_status is None:
+            raise KeyError(session_id)
+        return dialog_status
+
+    def __setitem__(self, session_id, dialog_status):
+        # new dialog status replaces the saved one
+        version = self.state.save(session_id, dialog_status.current_status,
+                                  getattr(dialog_status, "state_version", None))
+        if version is None:
+            metrics.incr("sessions.conflict")
+            raise RuntimeError("session {} was changed by another process".format(session_id))
+        dialog_status.state_version = version
+
+    def pop(self, session_id, default=None):
+        dialog_status = self.get(session_id, default)
+        self.state.delete(session_id)
+        return dialog_status
+
+    def __delitem__(self, session_id):
+        self.state.delete(session_id)
+
+    def sweep(self):
+        """
+            delete expired sessions
+        """
+        n = self.state.sweep(time.time() - self.ttl)
+        if n > 0:
+            metrics.incr("sessions.evicted.ttl", n)
+        return n
+
+    def _sweep_loop(self):
+        while not self.stopped.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception as err:
+                print("session sweep error:", err)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+import os, json, weakref, hashlib, threading, torch
+from concurrent.futures import Future
+
+'''
+    Author: Pengjia Zhu (zhupengjia@gmail.com)
+'''
+
+
+class SharedResources(dict):
+    def __init__(self, parent=None):
+        """
+            Thread-safe cache of resources shared between skills during build, such as dialogflow readers, embeddings and checkpoints. Each resource is identified by a key built from its source file or config, and is created only once even if requested concurrently.
+
+            It is a dictionary, so can be passed directly as shared_layers of models
+
+            Input:
+                - parent: SharedResources living longer than this build, e.g. shared by several tenants, used via self.shared.
+                    default is None to use this one
+        """
+        super(SharedResources, self).__init__()
+        self.lock = threading.Lock()
+        self.futures = {}
+        # deduped tensors are not kept alive by the cache, freed with the last skill using them
+        self.tensors = weakref.WeakValueDictionary()
+        self.shared = self if parent is None else parent
+
+    @staticmethod
+    def key(*args, **kwargs):
+        """
+            hashable key from parameters
+        """
+        return json.dumps([args, kwargs], sort_keys=True, default=str)
+
+    def get_or_create(self, key, factory, *args, **kwargs):
+        """
+            return the cached resource of key, or create it via factory(*args, **kwargs). Concurrent callers with the same key wait for the first one
+
+            Input:
+                - key: hashable key
+                - factory: callable to create resource
+        """
+        with self.lock:
+            future = self.futures.get(key, None)
+            owner = future is None
+            if owner:
+                future = self.futures[key] = Future()
+        if owner:
+            try:
+                future.set_result(factory(*args, **kwargs))
+            except Exception as err:
+                future.set_exception(err)
+        return future.result()
+
+    def checkpoint(self, saved_model):
+        """
+            load model checkpoint to cpu
+
+            Input:
+                - saved_model: path of checkpoint
+        """
+        return self.get_or_create(("checkpoint", os.path.abspath(saved_model)),
+                                  torch.load, saved_model,
+                                  map_location=lambda storage, location: storage)
+
+    def dedupe_parameters(self, module):
+        """
+            replace parameters and buffers of module with identical ones already seen, e.g. the same pretrained
+            encoder used by skills of several tenants. Tensors are compared by device, dtype, shape and content.
+            Return number of replaced tensors
+
+            Input:
+                - module: torch.nn.Module
+        """
+        replaced = 0
+        for submodule in module.modules():
+            for tensors in [submodule._parameters, submodule._buffers]:
+                for name, tensor in tensors.items():
+                    if tensor is None:
+                        continue
+                    data = tensor.detach().cpu().contiguous()
+                    if data.dtype == torch.bfloat16:
+                        data = data.float()
+                    digest = hashlib.blake2b(data.numpy().tobytes(), digest_size=16).hexdigest()
+                    key = ("tensor", str(tensor.device), str(tensor.dtype), tuple(tensor.shape), digest)
+                    with self.lock:
+                        shared = self.tensors.get(key, None)
+                        if shared is None:
+                            shared = self.tensors[key] = tensor
+                    if shared is not tensor:
+                        tensors[name] = shared
+                        replaced += 1
+        return replaced
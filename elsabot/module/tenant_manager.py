@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+import copy, time, threading
+from nlptools.utils import Config
+from .interact_session import InteractSession
+from .shared_resources import SharedResources
+from .metrics import metrics
+
+'''
+    Author: Pengjia Zhu (zhupengjia@gmail.com)
+'''
+
+
+class TenantManager:
+    def __init__(self, tenants, default=None, metrics_config=None, record_traffic=None):
+        """
+            Several bots hosted in one process, each tenant is an interact session built from its own config,
+            with its own topic manager and sessions. Tokenizers, sentiment analyzer, spell correction and NER with
+            the same config, embeddings and identical model weights are shared between tenants.
+
+            It can be used as the session of default tenant
+
+            Input:
+                - tenants: dictionary of {tenant_name: config file or configure dictionary}
+                - default: default tenant name when tenant is not given, default is None for the first tenant
+                - metrics_config: dictionary of metrics config shared by all tenants, default is None,
+                    see ..module.metrics.Metrics.configure
+                - record_traffic: overrides record_traffic of all tenant configs, False to disable recording,
+                    default is None to keep tenant configs
+        """
+        if metrics_config:
+            metrics.configure(**metrics_config)
+        self.shared = SharedResources()
+        self.tenants = {}
+        build_time = {}
+        for name, config in tenants.items():
+            config = copy.deepcopy(config) if isinstance(config, dict) else Config(config)
+            if record_traffic is not None:
+                config["record_traffic"] = record_traffic
+            start_time = time.time()
+            self.tenants[name] = InteractSession.build(config, shared=self.shared, tenant=name)
+            build_time[name] = time.time() - start_time
+        # cold start latencies of all tenants are not kept
+        metrics.reset()
+        for name, seconds in build_time.items():
+            metrics.observe("build.tenant.{}".format(name), seconds)
+        metrics.gauge("sessions", lambda: len(self))
+        self.default = default if default is not None else next(iter(self.tenants))
+        if self.default not in self.tenants:
+            raise KeyError("Tenant {} not existed".format(self.default))
+        self.ready = threading.Event()
+        self.ready.set()
+
+    def __getitem__(self, tenant):
+        """
+            session of tenant, raise KeyError if not existed
+
+            Input:
+                - tenant: string, None for default tenant
+        """
+        tenant = self.default if tenant is None else tenant
+        if tenant not in self.tenants:
+            raise KeyError("Tenant {} not existed".format(tenant))
+        return self.tenants[tenant]
+
+    def __call__(self, query, session_id="default", return_topic=False):
+        return self[None](query, session_id=session_id, return_topic=return_topic)
+
+    def call_batch(self, queries, return_topic=False):
+        return self[None].call_batch(queries, return_topic=return_topic)
+
+    def stream(self, query, session_id="default"):
+        return self[None].stream(query, session_id)
+
+    def reset(self, session_id):
+        return self[None].reset(session_id)
+
+    def fallback(self, session_id):
+        return self[None].fallback(session_id)
+
+    def reload_skill(self, skill_name, config=None, background=True):
+        """
+            reload one skill of a tenant, see ..module.interact_session.InteractSession.reload_skill
+
+            Input:
+                - skill_name: "TENANT/SKILL_NAME", or SKILL_NAME of default tenant
+        """
+        tenant, _, skill_name = skill_name.rpartition("/")
+        return self[tenant or None].reload_skill(skill_name, config=config, background=background)
+
+    def start(self, worker_id=None):
+        for session in self.tenants.values():
+            session.start(worker_id)
+
+    def stop(self):
+        for session in self.tenants.values():
+            session.stop()
+
+    def close(self):
+        for session in self.tenants.values():
+            session.close()
+
+    def __len__(self):
+        """
+            number of sessions of all tenants
+        """
+        return sum(len(session) for session in self.tenants.values())
+
+    def metrics(self):
+        """
+            snapshot of serving metrics, with number of sessions of each tenant
+        """
+        snapshot = metrics.snapshot()
+        snapshot["tenants"] = {name: len(session) for name, session in self.tenants.items()}
+        return snapshot
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 import copy
 from ..skills.cmd_response import CMDResponse
+from .metrics import metrics
 
 """
     Author: Pengjia Zhu (zhupengjia@gmail.com)
@@ -17,14 +18,15 @@ class TopicManager:
 
     def register(self, skill_name, skill_instance):
         """
-            Register topic
+            Register topic, replace the existed one with the same name
 
             Input:
                 - skill_name: string
                 - skill_instance: instance of skill
         """
         self.skills[skill_name] = skill_instance
-        self.skill_names.append(skill_name)
+        if skill_name not in self.skill_names:
+            self.skill_names.append(skill_name)
 
     def update_response_masks(self, current_status):
         """
@@ -34,8 +36,9 @@ class TopicManager:
                 - current_status: dictionary of status, generated from Dialog_Status module
         """
         for s in current_status["$TOPIC_LIST"]:
-            current_status["$TENSOR_RESPONSE_MASK"][s] = \
-                    self.skills[s].update_mask(current_status)
+            with metrics.timer("skill.{}.update_mask".format(s)):
+                current_status["$TENSOR_RESPONSE_MASK"][s] = \
+                        self.skills[s].update_mask(current_status)
         return current_status
 
     def update_response(self, response_value, current_status):
@@ -48,7 +51,8 @@ class TopicManager:
         """
         current_status["$RESPONSE"] = None # clear response
         if response_value is not None:
-            current_status = self.skills[current_status["$TOPIC"]].update_response(response_value, current_status)
+            with metrics.timer("skill.{}.update_response".format(current_status["$TOPIC"])):
+                current_status = self.skills[current_status["$TOPIC"]].update_response(response_value, current_status)
         return current_status
 
     def redirect_message(self, current_status):
@@ -57,6 +61,30 @@ class TopicManager:
         current_status["$RESPONSE_SCORE"] = 1
         return current_status
 
+    def early_dispatch(self, current_status, utterance):
+        """
+            answer command via CMD skill, or relay message if session is redirected, before the utterance goes
+            through the NLP pipeline. Return updated status if dispatched, otherwise None
+
+            Input:
+                - current_status: dictionary of status, generated from dialog_status module
+                - utterance: string, raw utterance
+        """
+        if utterance.startswith("`"):
+            current_status["$UTTERANCE"] = utterance
+            current_status["$RESPONSE"] = None
+            response_value, response_score = self.skills["cmd"].get_response(None, current_status)
+            current_status = self.skills["cmd"].update_response(response_value, current_status)
+            if current_status["$RESPONSE"] is None and not current_status["$SESSION_RESET"]:
+                # e.g. disconnect, the utterance is answered by other skills
+                return None
+            current_status["$RESPONSE_SCORE"] = response_score
+            return current_status
+        if current_status["$REDIRECT_SESSION"]:
+            current_status["$UTTERANCE"] = utterance
+            return self.redirect_message(current_status)
+        return None
+
     def get_topic(self, current_status=None):
         """
             Todo: will use classification method to choose topic
@@ -73,57 +101,112 @@ class TopicManager:
                 - incre_state: incremental state, default is None
 
         """
-        old_skill = current_status["$TOPIC"]
-        skill_names = copy.deepcopy(current_status["$TOPIC_LIST"])
-        origin_skill_names = copy.deepcopy(current_status["$TOPIC_LIST"])
-        
-        finished_skill = set()
-
-        # CMD skill
-        response_value, response_score = self.skills["cmd"].get_response(current_data, current_status)
-        if response_value is not None:
-            current_status = self.skills["cmd"].update_response(response_value, current_status)
-            if current_status["$RESPONSE"] is not None:
-                return current_status
+        return self.get_response_batch(current_data, [current_status],
+                                       incre_state=incre_state, **args)[0]
 
-        # check if redirect message
-        if current_status["$REDIRECT_SESSION"]:
-            current_status = self.redirect_message(current_status)
-            return current_status
+    def _next_skill(self, state, current_status):
+        """
+            move to the next skill waiting for response, return None if no skill left
 
-        while len(skill_names) > 0:
-            skill = skill_names[0]
-            if current_status["$TOPIC_LIST"] != origin_skill_names:
-                skill_names = copy.deepcopy(current_status["$TOPIC_LIST"])
-                origin_skill_names = copy.deepcopy(current_status["$TOPIC_LIST"])
+            Input:
+                - state: dictionary of skill loop state of current status
+                - current_status: dictionary of status, generated from dialog_status module
+        """
+        while len(state["skill_names"]) > 0:
+            skill = state["skill_names"][0]
+            if current_status["$TOPIC_LIST"] != state["origin_skill_names"]:
+                state["skill_names"] = copy.deepcopy(current_status["$TOPIC_LIST"])
+                state["origin_skill_names"] = copy.deepcopy(current_status["$TOPIC_LIST"])
                 continue
-            if skill in finished_skill:
-                skill_names.pop(0)
+            if skill in state["finished_skill"]:
+                state["skill_names"].pop(0)
                 continue
             if current_status["$TOPIC_NEXT"] and skill != current_status["$TOPIC_NEXT"]:
                 #check if TOPIC_NEXT in entity, if yes, will try to jump to that skill
-                finished_skill.add(skill)
-                skill_names.pop(0)
+                state["finished_skill"].add(skill)
+                state["skill_names"].pop(0)
                 continue
-            current_status["$TOPIC"] = skill
-            # response mask
-            response_value, response_score = self.skills[skill].get_response(current_data, current_status, incre_state=incre_state, **args)
-            current_status["$TOPIC_NEXT"] = None #clear TOPIC_NEXT
-            current_status["$RESPONSE_SCORE"] = response_score
-            finished_skill.add(skill)
-            skill_names.pop(0)
+            return skill
+        return None
+
+    def get_response_batch(self, current_data, status_list, incre_state=None, **args):
+        """
+            get responses for a batch of status. In each round the status waiting for the same skill are
+            predicted together, so each skill model runs once for the whole batch
+
+            Input:
+                - current_data: batch data converted from status list, see ..module.dialog_status.status_collate
+                - status_list: list of current_status dictionaries, generated from dialog_status module
+                - incre_state: incremental state, only used if batch size is 1, default is None
+
+            Output:
+                - list of updated status
+        """
+        status_list = list(status_list)
+        states = {}
+        for i, current_status in enumerate(status_list):
+            # CMD skill
+            response_value, response_score = self.skills["cmd"].get_response(None, current_status)
             if response_value is not None:
-                # get final response
-                current_status = self.update_response(response_value, current_status)
+                current_status = self.skills["cmd"].update_response(response_value, current_status)
+                status_list[i] = current_status
                 if current_status["$RESPONSE"] is not None:
-                    break
-        if response_value is None:
-            current_status["$TOPIC"] = old_skill
-            current_status["$RESPONSE"] = ":)"
-            current_status["$RESPONSE_SCORE"] = 0
-            return current_status
+                    continue
 
-        return current_status
+            # check if redirect message
+            if current_status["$REDIRECT_SESSION"]:
+                status_list[i] = self.redirect_message(current_status)
+                continue
+
+            states[i] = {"old_skill": current_status["$TOPIC"],
+                         "skill_names": copy.deepcopy(current_status["$TOPIC_LIST"]),
+                         "origin_skill_names": copy.deepcopy(current_status["$TOPIC_LIST"]),
+                         "finished_skill": set(),
+                         "response_value": response_value}
+
+        while len(states) > 0:
+            # group status by the skill they are waiting for
+            skill_groups = {}
+            for i in list(states):
+                skill = self._next_skill(states[i], status_list[i])
+                if skill is None:
+                    if states[i]["response_value"] is None:
+                        metrics.incr("fallback.no_response")
+                        status_list[i]["$TOPIC"] = states[i]["old_skill"]
+                        status_list[i]["$RESPONSE"] = ":)"
+                        status_list[i]["$RESPONSE_SCORE"] = 0
+                    del states[i]
+                    continue
+                if skill not in skill_groups:
+                    skill_groups[skill] = []
+                skill_groups[skill].append(i)
+
+            for skill, ids in skill_groups.items():
+                for i in ids:
+                    status_list[i]["$TOPIC"] = skill
+                if len(status_list) == 1:
+                    skill_data, skill_incre_state = current_data, incre_state
+                else:
+                    skill_data, skill_incre_state = current_data.select(ids), {}
+                with metrics.timer("skill.{}.get_response".format(skill)):
+                    results = self.skills[skill].get_response_batch(skill_data,
+                                                                    [status_list[i] for i in ids],
+                                                                    incre_state=skill_incre_state,
+                                                                    **args)
+                for i, (response_value, response_score) in zip(ids, results):
+                    current_status = status_list[i]
+                    current_status["$TOPIC_NEXT"] = None #clear TOPIC_NEXT
+                    current_status["$RESPONSE_SCORE"] = response_score
+                    states[i]["finished_skill"].add(skill)
+                    states[i]["skill_names"].pop(0)
+                    states[i]["response_value"] = response_value
+                    if response_value is not None:
+                        # get final response
+                        status_list[i] = self.update_response(response_value, current_status)
+                        if status_list[i]["$RESPONSE"] is not None:
+                            del states[i]
+
+        return status_list
 
     def add_response(self, response, current_status):
         """
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+import threading, collections
+from concurrent.futures import Future, ThreadPoolExecutor
+from .admission import Overloaded
+from .metrics import metrics
+
+'''
+    Author: Pengjia Zhu (zhupengjia@gmail.com)
+'''
+
+
+class TurnExecutor:
+    def __init__(self, max_workers=8, max_pending=1000):
+        """
+            Run turns of chat backends in threads, out of the event loop or dispatcher of the chat library.
+            Turns of the same chat are run one by one in order, turns of different chats are run concurrently
+            and take turns on the threads, so a chat with many queued turns can't occupy all threads
+
+            Input:
+                - max_workers: int, maximum turns running together, default is 8
+                - max_pending: int, maximum queued and running turns, more are rejected with
+                    ..module.admission.Overloaded, default is 1000
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.chats = {}
+        self.pending = 0
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        metrics.gauge("queue.turns", lambda: self.pending)
+
+    def submit(self, chat_id, func, *args):
+        """
+            queue func(*args) as a turn of chat_id, return a future
+
+            Input:
+                - chat_id: hashable chat id
+                - func: callable
+        """
+        future = Future()
+        with self.lock:
+            if self.pending >= self.max_pending:
+                metrics.incr("admission.turns.rejected.queue_full")
+                raise Overloaded("turns", "queue_full")
+            self.pending += 1
+            if chat_id in self.chats:
+                self.chats[chat_id].append((func, args, future))
+                return future
+            self.chats[chat_id] = collections.deque([(func, args, future)])
+        self.executor.submit(self._run, chat_id)
+        return future
+
+    def _run(self, chat_id):
+        # the turn is kept in queue while running, so new turns of this chat wait
+        with self.lock:
+            func, args, future = self.chats[chat_id][0]
+        try:
+            future.set_result(func(*args))
+        except Exception as err:
+            future.set_exception(err)
+        with self.lock:
+            self.pending -= 1
+            queue = self.chats[chat_id]
+            queue.popleft()
+            if len(queue) < 1:
+                del self.chats[chat_id]
+                return
+        # the next turn of this chat waits behind turns of other chats
+        self.executor.submit(self._run, chat_id)
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+import gc, zlib, queue, itertools, threading, multiprocessing, torch
+from concurrent.futures import Future, ThreadPoolExecutor
+
+'''
+    Author: Pengjia Zhu (zhupengjia@gmail.com)
+'''
+
+
+class WorkerPool:
+    inline_methods = {"fallback"} # quick methods run in the receiving thread of worker
+
+    def __init__(self, session, workers=2, worker_threads=4, num_threads=None, fallback_timeout=1, **args):
+        """
+            Pre-forked worker processes serving one interact session. The session is built once
+            in the parent process, model weights are moved to shared memory and inherited
+            by the workers. Each session_id is always routed to the same worker.
+
+            Redirected messages via $REDIRECT_SESSION still work across workers, the relay target
+            is returned as session_id of the response and sent by the backend.
+
+            Background threads of the session are stopped in the parent process before forking and started
+            in each worker, the parent keeps no sessions
+
+            Input:
+                - session: instance of ..module.interact_session.InteractSession
+                - workers: int, number of worker processes, default is 2
+                - worker_threads: int, concurrent queries in each worker, used by micro batching, default is 4
+                - num_threads: int, torch threads in each worker, default is None to keep torch default
+                - fallback_timeout: float, seconds to wait for the fallback of the worker when overloaded,
+                    default is 1
+        """
+        self.session = session
+        self.workers = workers
+        self.worker_threads = worker_threads
+        self.num_threads = num_threads
+        self.fallback_timeout = fallback_timeout
+        self.request_ids = itertools.count()
+        self.pending = [{} for _ in range(workers)]
+        self.locks = [threading.Lock() for _ in range(workers)]
+
+        self._share_memory()
+        # no thread of session holds a lock when forked
+        self.session.stop()
+        context = multiprocessing.get_context("fork")
+        self.connections, self.processes = [], []
+        for i in range(workers):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=self._worker, args=(i, child_conn), daemon=True)
+            process.start()
+            child_conn.close()
+            self.connections.append(parent_conn)
+            self.processes.append(process)
+            threading.Thread(target=self._receive, args=(i,), daemon=True).start()
+
+    def _share_memory(self):
+        for skill in self.session.topic_manager.skills.values():
+            for value in vars(skill).values():
+                if isinstance(value, torch.nn.Module):
+                    value.share_memory()
+        # objects existed before fork will not be touched by garbage collector,
+        # keeps their memory pages shared
+        gc.collect()
+        if hasattr(gc, "freeze"):
+            gc.freeze()
+
+    def _worker(self, worker_id, conn):
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        self.session.start(worker_id)
+        lock = threading.Lock()
+        executor = ThreadPoolExecutor(max_workers=self.worker_threads)
+
+        def run(request_id, method, args):
+            try:
+                result = getattr(self.session, method)(*args)
+                if method == "stream":
+                    # generator results are sent one by one
+                    for item in result:
+                        with lock:
+                            conn.send((request_id, "partial", item))
+                    result = None
+                result = (request_id, True, result)
+            except Exception as err:
+                result = (request_id, False, RuntimeError(repr(err)))
+            with lock:
+                conn.send(result)
+
+        while True:
+            try:
+                request = conn.recv()
+            except EOFError:
+                break
+            if request is None:
+                break
+            if request[1] in self.inline_methods:
+                # answered at once without waiting for busy threads
+                run(*request)
+            else:
+                executor.submit(run, *request)
+
+    def _receive(self, worker_id):
+        conn = self.connections[worker_id]
+        while True:
+            try:
+                request_id, success, result = conn.recv()
+            except (EOFError, OSError):
+                break
+            if success == "partial":
+                self.pending[worker_id][request_id].partial.put(result)
+                continue
+            future = self.pending[worker_id].pop(request_id)
+            if success:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+            if hasattr(future, "partial"):
+                future.partial.put(None)
+        # worker stopped
+        for future in list(self.pending[worker_id].values()):
+            future.set_exception(RuntimeError("worker {} stopped".format(worker_id)))
+            if hasattr(future, "partial"):
+                future.partial.put(None)
+        self.pending[worker_id].clear()
+
+    @property
+    def ready(self):
+        """
+            ready event of session, the session is warmed up before workers are forked
+        """
+        return self.session.ready
+
+    def worker_id(self, session_id):
+        """
+            worker index of session_id
+        """
+        return zlib.crc32(str(session_id).encode("utf-8")) % self.workers
+
+    def submit(self, worker_id, method, *args, partial=False):
+        """
+            call method of session in worker, return a future
+
+            Input:
+                - worker_id: int, worker index
+                - method: string, method name of session
+                - partial: bool, add a queue as future.partial to receive items of generator result,
+                    None is put at the end, default is False
+        """
+        future = Future()
+        if partial:
+            future.partial = queue.Queue()
+        request_id = next(self.request_ids)
+        self.pending[worker_id][request_id] = future
+        with self.locks[worker_id]:
+            self.connections[worker_id].send((request_id, method, args))
+        return future
+
+    def __call__(self, query, session_id="default", return_topic=False):
+        """
+            get response from the worker of session_id
+
+            Input:
+                - query: string
+                - session_id: string, session id, default is "default"
+                - return_topic: bool, also return the chosen topic, default is False
+        """
+        return self.submit(self.worker_id(session_id), "__call__", query, session_id, return_topic).result()
+
+    def stream(self, query, session_id="default"):
+        """
+            get response as a generator from the worker of session_id,
+            see ..module.interact_session.InteractSession.stream
+
+            Input:
+                - query: string
+                - session_id: string, session id, default is "default"
+        """
+        future = self.submit(self.worker_id(session_id), "stream", query, session_id, partial=True)
+        while True:
+            item = future.partial.get()
+            if item is None:
+                future.result() # raise error from worker
+                return
+            yield item
+
+    def call_batch(self, queries, return_topic=False):
+        """
+            get responses for a batch of queries, queries are split to their workers and answered concurrently
+
+            Input:
+                - queries: list of (query, session_id)
+                - return_topic: bool, also return the chosen topic of each query, default is False
+        """
+        groups = {}
+        for i, (query, session_id) in enumerate(queries):
+            groups.setdefault(self.worker_id(session_id), []).append(i)
+        futures = {w: self.submit(w, "call_batch", [queries[i] for i in ids], return_topic)
+                   for w, ids in groups.items()}
+        results = [None] * len(queries)
+        for w, ids in groups.items():
+            for i, result in zip(ids, futures[w].result()):
+                results[i] = result
+        return results
+
+    def fallback(self, session_id):
+        """
+            degraded reply from the worker of session_id, answered without waiting for running queries.
+            If the worker doesn't answer within fallback_timeout, the generic fallback of the session in this
+            process is returned, which doesn't know the topic of session.
+            see ..module.interact_session.InteractSession.fallback
+        """
+        try:
+            return self.submit(self.worker_id(session_id), "fallback", session_id).result(timeout=self.fallback_timeout)
+        except Exception:
+            return self.session.fallback(session_id)
+
+    def reset(self, session_id):
+        """
+            reset the session for session_id
+        """
+        return self.submit(self.worker_id(session_id), "reset", session_id).result()
+
+    def reload_skill(self, skill_name, config=None, background=True):
+        """
+            reload one skill in all workers, see ..module.interact_session.InteractSession.reload_skill
+
+            Input:
+                - skill_name: string
+                - config: configure dictionary, default is None to use the one from build
+                - background: bool, return without waiting workers, default is True
+
+            Output:
+                - list of futures if background, otherwise None
+        """
+        if skill_name not in self.session.config.skills:
+            raise KeyError("Skill {} not existed in config".format(skill_name))
+        futures = [self.submit(i, "reload_skill", skill_name, config, False) for i in range(self.workers)]
+        if background:
+            return futures
+        for f in futures:
+            f.result()
+        return None
+
+    def __len__(self):
+        """
+            number of sessions in all workers
+        """
+        futures = [self.submit(i, "__len__") for i in range(self.workers)]
+        return sum(f.result() for f in futures)
+
+    def metrics(self):
+        """
+            metrics of each worker
+        """
+        futures = [self.submit(i, "metrics") for i in range(self.workers)]
+        return {"workers": [f.result() for f in futures]}
+
+    def close(self):
+        """
+            stop all workers
+        """
+        for i, conn in enumerate(self.connections):
+            with self.locks[i]:
+                conn.send(None)
+        for process in self.processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self.session.close()
@@ -4,7 +4,7 @@
 
     Reader for dialog flow excel format config
 '''
-import os, re, pandas, random, numpy, ipdb
+import os, re, pandas, random, numpy, threading, ipdb
 from nlptools.utils import decode_child_id, flat_list
 from nlptools.text.ngrams import Ngrams
 from nlptools.text import TFIDF
@@ -28,6 +28,7 @@ class ReaderXLSX:
             raise('{} not exists!!!'.format(self.dialog_file))
         self.tokenizer = Tokenizer_Simple() if tokenizer is None else tokenizer
         self.index = None
+        self.lock = threading.Lock()
 
         self.entities = self._parse_entity()
         
@@ -62,13 +63,26 @@ class ReaderXLSX:
                 - id: int, intent id
                 - usersay: string
         """
-        if self.dialogs["user_says"].loc[idx] is None:
-            self.dialogs["user_says"].loc[idx] = [usersay]
-            self.dialogs["user_say_tokens"].loc[idx] = [self._mixed_tokenizer(usersay)]
-        else:
-            self.dialogs["user_says"].loc[idx].append(usersay)
-            self.dialogs["user_say_tokens"].loc[idx].append(self._mixed_tokenizer(usersay))
-        self.index["user_says"] = self._build_index(self.dialogs["user_say_tokens"])
+        self.add_usersays([(idx, usersay)])
+
+    def add_usersays(self, usersays):
+        """
+            Add several usersays, the search index is rebuilt once
+
+            Input:
+                - usersays: list of (intent id, usersay)
+        """
+        if len(usersays) < 1:
+            return
+        with self.lock:
+            for idx, usersay in usersays:
+                if self.dialogs["user_says"].loc[idx] is None:
+                    self.dialogs["user_says"].loc[idx] = [usersay]
+                    self.dialogs["user_say_tokens"].loc[idx] = [self._mixed_tokenizer(usersay)]
+                else:
+                    self.dialogs["user_says"].loc[idx].append(usersay)
+                    self.dialogs["user_say_tokens"].loc[idx].append(self._mixed_tokenizer(usersay))
+            self.index["user_says"] = self._build_index(self.dialogs["user_say_tokens"])
 
     def get_usersays(self, idx):
         """
@@ -178,13 +192,24 @@ class ReaderXLSX:
         if isinstance(sentence, str):
             sentence = re.sub('[^^a-zA-Z ]', '', sentence)
             sentence = self.tokenizer(sentence)
-        token_ids = flat_list(self.index[target]["vocab"](sentence).values())
-        result = self.index[target]["index"].search_index(token_ids, topN=n_top)
-        return numpy.array([self.index[target]["ids"][r[0]] for r in result])
+        index = self.index[target] # snapshot, replaced by add_usersay
+        token_ids = flat_list(index["vocab"](sentence).values())
+        result = index["index"].search_index(token_ids, topN=n_top)
+        return numpy.array([index["ids"][r[0]] for r in result])
 
     def _parse_entity(self):
+        return self.parse_entities(self.dialog_file)
+
+    @classmethod
+    def parse_entities(cls, dialog_file):
+        """
+            read entities sheet only, used to build NER without loading the whole dialog flow
+
+            Input:
+                - dialog_file: xlsx file of rule definition
+        """
         try:
-            entities_table = pandas.read_excel(self.dialog_file,
+            entities_table = pandas.read_excel(dialog_file,
                                                sheet_name="entities").iloc[:, 1:]
         except Exception as error:
             print(error)
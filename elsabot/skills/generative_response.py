@@ -55,7 +55,7 @@ class GenerativeResponse(SkillBase):
                            }
         args = {**args, **additional_args}
         if os.path.exists(saved_model):
-            self.checkpoint = torch.load(saved_model, map_location=lambda storage, location: storage)
+            self.checkpoint = self.load_checkpoint(saved_model, args.get("shared_layers", None))
             model_cfg = self.checkpoint['config_model']
             def copy_args(target_key, source_layer, source_key):
                 if source_key in model_cfg[source_layer]:
@@ -110,6 +110,35 @@ class GenerativeResponse(SkillBase):
             response_value = result[0][0].cpu().detach().numpy()
             return response_value, score
 
+    def get_response_batch(self, status_data, status_list, incre_state=None, stream_callback=None, **args):
+        """
+            predict response values for a batch of status, beam search runs for all status together
+
+            Input:
+                - status_data: batch data converted from status list
+                - status_list: list of current_status dictionaries, generated from dialog_status module
+                - incre_state: incremental state, default is None
+                - stream_callback: callable, called as stream_callback(current_status, text) with new text pieces
+                    once decoding settles them, default is None. Entities are not replaced in the pieces,
+                    the final response is set by update_response
+        """
+        step_callback = None
+        if stream_callback is not None:
+            token_ids = [[] for _ in status_list]
+            texts = ["" for _ in status_list]
+
+            def step_callback(j, tokens):
+                token_ids[j] += tokens
+                text = self.tokenizer.tokens2sentence(self.vocab.id2words(token_ids[j]))
+                # wait for more tokens if previous text is changed by tokens joining
+                if text.startswith(texts[j]) and len(text) > len(texts[j]):
+                    stream_callback(status_list[j], text[len(texts[j]):])
+                    texts[j] = text
+
+        output, scores = self.model(status_data, incre_state, step_callback=step_callback)
+        output = output.cpu().detach().numpy()
+        return [(output[i], numpy.exp(scores[i])) for i in range(len(status_list))]
+
     def update_response(self, response, current_status):
         """
             update current response to the response status.
@@ -38,8 +38,7 @@ class GoalResponse(RuleResponse):
         additional_args = {"skill_name":self.skill_name}
         args = {**args, **additional_args}
         if os.path.exists(saved_model):
-            self.checkpoint = torch.load(saved_model,
-                                    map_location=lambda storage, location: storage)
+            self.checkpoint = self.load_checkpoint(saved_model, args.get("shared_layers", None))
 
             model_cfg = self.checkpoint['config_model']
             def copy_args(target_key, source_layer, source_key):
@@ -93,3 +92,18 @@ class GoalResponse(RuleResponse):
         score = y_prob[0, y_pred].cpu().detach().numpy()
         return y_pred, score
 
+    def get_response_batch(self, status_data, status_list, incre_state=None, **args):
+        """
+            predict response values for a batch of status in one forward pass
+
+            Input:
+                - status_data: batch data converted from status list
+                - status_list: list of current_status dictionaries, generated from dialog_status module
+                - incre_state: incremental state, default is None
+        """
+        y_prob = self.model(status_data, incre_state)
+        _, y_pred = torch.max(y_prob.data, 1)
+        y_pred = y_pred.cpu().numpy()
+        y_prob = y_prob.cpu().detach().numpy()
+        return [(int(y_pred[i]), y_prob[i, y_pred[i]]) for i in range(len(status_list))]
+
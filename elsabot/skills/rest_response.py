@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 import requests, json, random
+from concurrent.futures import ThreadPoolExecutor
 from .skill_base import SkillBase
 """
     Author: Pengjia Zhu (zhupengjia@gmail.com)
@@ -10,11 +11,13 @@ class RestResponse(SkillBase):
     '''
         Restapi based skill
     '''
-    def __init__(self, skill_name, rest_url, timeout=3, **args):
+    warmup = False # no local model, don't send synthetic utterances to the remote api
+    def __init__(self, skill_name, rest_url, timeout=3, max_concurrency=8, **args):
         super().__init__(skill_name)
         self.rest_url = rest_url
         self.session_id = str(random.randint(10000000,99999999))
         self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
         self.headers = {'User-Agent' : "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/534.30 (KHTML, like Gecko) Ubuntu/11.04 Chromium/12.0.742.112 Chrome/12.0.742.112 Safari/534.30"}
         self.rest_post("clear")
 
@@ -40,3 +43,7 @@ class RestResponse(SkillBase):
     def get_response(self, status_data, current_status, incre_state=None, **args):
         result = self.rest_post(current_status["$UTTERANCE"])
         return result["response"], result["score"]
+
+    def get_response_batch(self, status_data, status_list, incre_state=None, **args):
+        results = self.executor.map(self.rest_post, [s["$UTTERANCE"] for s in status_list])
+        return [(r["response"], r["score"]) for r in results]
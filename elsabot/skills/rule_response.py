@@ -3,13 +3,15 @@
     Author: Pengjia Zhu (zhupengjia@gmail.com)
     Response skill for rule-based chatbot
 """
-import numpy, re
+import numpy, re, threading
 import ipdb
 from nlptools.text.docsim import WMDSim
 from nlptools.text.embedding import Embedding
 from nlptools.text.tokenizer import format_sentence
 from rapidfuzz import fuzz
 from .skill_base import SkillBase
+from ..module.metrics import metrics
+from ..module.shared_resources import SharedResources
 
 
 class RuleResponse(SkillBase):
@@ -22,6 +24,9 @@ class RuleResponse(SkillBase):
         self.tokenizer = tokenizer
         self.vocab = vocab
         self.max_seq_len = max_seq_len
+        self.index_lock = threading.Lock()
+        self.learned_usersays = [] # (response_id, usersay) learned from user choices
+        self.learned_set = set()
 
     def __getitem__(self, response):
         """
@@ -52,7 +57,9 @@ class RuleResponse(SkillBase):
         mask = mask_need * mask_notneed
 
         if self.skill_name in current_status["$CHILD_ID"]\
-           and isinstance(current_status["$CHILD_ID"][self.skill_name], numpy.ndarray):
+           and isinstance(current_status["$CHILD_ID"][self.skill_name], numpy.ndarray)\
+           and current_status["$CHILD_ID"][self.skill_name].shape == mask.shape:
+            # child mask from an older dialogflow is ignored after reload
             mask = mask * current_status["$CHILD_ID"][self.skill_name]
 
         return mask.astype("float32")
@@ -115,12 +122,14 @@ class RuleResponse(SkillBase):
         current_status['$CHILD_ID'][self.skill_name] = self.dialogflow.dialogs.loc[response_id, 'child_id']
         return current_status
 
-    def init_model(self, device='cpu', prefilter=500, score_tolerate=0.01, min_score=0.7, believe_score=0.85, confuse_reply="Please select:", **args):
+    def init_model(self, device='cpu', prefilter=500, score_tolerate=0.01, min_score=0.7, believe_score=0.85, confuse_reply="Please select:", shared_layers=None, max_learned_usersays=10000, **args):
         """
             init similarity and predeal the dialog
 
             Input:
                 - device: string, model location, default is 'cpu'
+                - shared_layers: dictionary, embedding and similarity with the same parameters are shared between skills if it is an instance of ..module.shared_resources.SharedResources, default is None
+                - max_learned_usersays: int, maximum user says learned from user choices, default is 10000
                 - see ..model.similarity for more parameters if path of saved_model not existed
         """
         self.prefilter = prefilter
@@ -128,9 +137,17 @@ class RuleResponse(SkillBase):
         self.min_score = min_score
         self.believe_score = believe_score
         self.confuse_reply = confuse_reply
-        self.vocab.embedding = Embedding(**args)
-        self.similarity = WMDSim(vocab=self.vocab, **args)
-        self.similarity.to(device)
+        self.max_learned_usersays = max_learned_usersays
+        if not isinstance(shared_layers, SharedResources):
+            shared_layers = SharedResources()
+        key = shared_layers.key(**args)
+        self.vocab.embedding = shared_layers.shared.get_or_create(("embedding", key), Embedding, **args)
+
+        def build_similarity():
+            similarity = WMDSim(vocab=self.vocab, **args)
+            similarity.to(device)
+            return similarity
+        self.similarity = shared_layers.shared.get_or_create(("similarity", key, id(self.vocab), device), build_similarity)
         user_says_series = self.dialogflow.dialogs["user_say_tokens"]
 
         fallback_says = user_says_series.isnull()
@@ -161,49 +178,143 @@ class RuleResponse(SkillBase):
                 - current_status: dictionary of status, generated from dialog_status module
                 - incre_state: incremental state, default is None
         '''
-        # for special interaction
-        if self.skill_name in current_status["$CHILD_ID"]\
-           and current_status["$CHILD_ID"][self.skill_name] is not None\
-           and -10000 in current_status["$CHILD_ID"][self.skill_name]:
-            response_id = re.sub("\D", "", current_status["$UTTERANCE"])
-            if len(response_id) < 1:
-                return self.get_fallback(current_status)
-            response_id = int(response_id)
-            if response_id >= 0 and response_id <= len(current_status['$TENSOR_RESPONSE'][self.skill_name]):
-                response_id = current_status['$TENSOR_RESPONSE'][self.skill_name][response_id]
-                current_status['$TENSOR_RESPONSE'][self.skill_name] = response_id
-                usersay = current_status["$UTTERANCE_LAST"]
-                self.dialogflow.add_usersay(response_id, usersay)
-                _tmp = format_sentence(usersay,
-                                       vocab=self.vocab,
-                                       tokenizer=self.tokenizer,
-                                       max_seq_len=self.max_seq_len)
-                if _tmp is not None:
-                    _tmp_emb = self.similarity([_tmp[0]], [_tmp[1]])
-                    self.usersays_index["user_emb"] = numpy.array(list(self.usersays_index["user_emb"]) + [_tmp_emb[0]])
-                    self.usersays_index["ids"] = numpy.append(self.usersays_index["ids"], response_id)
-                return response_id, 1
-            return self.get_fallback(current_status)
+        return self.get_response_batch(status_data, [current_status], incre_state=incre_state, **args)[0]
+
+    def get_response_batch(self, status_data, status_list, incre_state=None, **args):
+        '''
+            get responses for a batch of status, the utterance embeddings are calculated together
+
+            Input:
+                - status_data: batch data converted from status list
+                - status_list: list of current_status dictionaries, generated from dialog_status module
+                - incre_state: incremental state, default is None
+        '''
+        results = [None] * len(status_list)
+        search_ids = []
+        for i, current_status in enumerate(status_list):
+            # for special interaction
+            if self.skill_name in current_status["$CHILD_ID"]\
+               and current_status["$CHILD_ID"][self.skill_name] is not None\
+               and -10000 in current_status["$CHILD_ID"][self.skill_name]:
+                results[i] = self._choose_response(current_status)
+            else:
+                search_ids.append(i)
+        if len(search_ids) < 1:
+            return results
 
         utterance, utterance_mask = status_data["utterance"].data, status_data["utterance_mask"].data
+        response_mask = status_data["$TENSOR_RESPONSE_MASK_"+self.skill_name].data
+        if len(search_ids) < len(status_list):
+            utterance, utterance_mask = utterance[search_ids], utterance_mask[search_ids]
+            response_mask = response_mask[search_ids]
+
+        # search by word embedding
+        utterance_embedding = self.similarity.get_embedding(utterance, utterance_mask)
+        utterance = utterance.cpu().detach().numpy()
+        utterance_mask = utterance_mask.cpu().detach().numpy().astype("bool_")
+        response_mask = response_mask.cpu().detach().numpy().astype("bool_")
+
+        for j, i in enumerate(search_ids):
+            results[i] = self._search_response(utterance[j][utterance_mask[j]],
+                                               utterance_embedding[j:j+1],
+                                               response_mask[j],
+                                               status_list[i])
+        return results
+
+    def _choose_response(self, current_status):
+        '''
+            get response from the user choice of previous response list
+        '''
+        response_id = re.sub("\D", "", current_status["$UTTERANCE"])
+        if len(response_id) < 1:
+            return self.get_fallback(current_status)
+        response_id = int(response_id)
+        if response_id >= 0 and response_id <= len(current_status['$TENSOR_RESPONSE'][self.skill_name]):
+            response_id = current_status['$TENSOR_RESPONSE'][self.skill_name][response_id]
+            current_status['$TENSOR_RESPONSE'][self.skill_name] = response_id
+            self._learn_usersay(response_id, current_status["$UTTERANCE_LAST"])
+            return response_id, 1
+        return self.get_fallback(current_status)
+
+    def _learn_usersay(self, response_id, usersay):
+        '''
+            add user say of response to dialogflow and search index
+        '''
+        self._learn_usersays([(response_id, usersay)])
+
+    def _learn_usersays(self, usersays):
+        '''
+            add user says as (response_id, usersay) to dialogflow and search index at once.
+            Learned ones are skipped, nothing is learned after max_learned_usersays
+        '''
+        new = []
+        with self.index_lock:
+            for response_id, usersay in usersays:
+                key = (int(response_id), usersay)
+                if key in self.learned_set or len(self.learned_set) >= self.max_learned_usersays:
+                    continue
+                self.learned_set.add(key)
+                new.append(key)
+        if len(new) < 1:
+            return
+        self.dialogflow.add_usersays(new)
+        sentence, sentence_masks, ids = [], [], []
+        for response_id, usersay in new:
+            _tmp = format_sentence(usersay,
+                                   vocab=self.vocab,
+                                   tokenizer=self.tokenizer,
+                                   max_seq_len=self.max_seq_len)
+            if _tmp is None: continue
+            sentence.append(_tmp[0])
+            sentence_masks.append(_tmp[1])
+            ids.append(response_id)
+        if len(sentence) > 0:
+            _tmp_emb = self.similarity(sentence, sentence_masks)
+            # copy on write, searching threads keep using the old index
+            with self.index_lock:
+                index = self.usersays_index
+                self.usersays_index = {**index,
+                                       "user_emb": numpy.array(list(index["user_emb"]) + list(_tmp_emb)),
+                                       "ids": numpy.append(index["ids"], ids)}
+        with self.index_lock:
+            self.learned_usersays += new
+
+    def export_state(self):
+        '''
+            learned user says
+        '''
+        return list(self.learned_usersays) or None
+
+    def import_state(self, state):
+        '''
+            learn user says again after rebuilt
+        '''
+        self._learn_usersays(state or [])
+
+    def _search_response(self, utterance_ids, utterance_embedding, response_mask, current_status):
+        '''
+            search the most closed user says for one utterance
+
+            Input:
+                - utterance_ids: numpy array of utterance token ids without padding
+                - utterance_embedding: embedding of utterance
+                - response_mask: numpy bool array of response mask
+                - current_status: dictionary of status, generated from dialog_status module
+        '''
+        index = self.usersays_index # snapshot, may be replaced by other threads
         # filter ids by tfidf
-        if self.usersays_index["ids"].shape[0] > self.prefilter:
-            utterance_ids = utterance[0].cpu().detach().numpy()[utterance_mask[0].cpu().detach().numpy().astype("bool_")]
+        if index["ids"].shape[0] > self.prefilter:
             utterance_tokens = self.vocab.id2words(utterance_ids[1:-1])
 
             ids = self.dialogflow.search(utterance_tokens, target="user_says", n_top=self.prefilter)
-            filter_idx = numpy.in1d(self.usersays_index["ids"], ids)
+            filter_idx = numpy.in1d(index["ids"], ids)
         else:
             filter_idx = True
 
-        # search by word embedding
-        utterance_embedding = self.similarity.get_embedding(utterance, utterance_mask)
-
-        response_mask = status_data["$TENSOR_RESPONSE_MASK_"+self.skill_name].data[0].cpu().detach().numpy().astype("bool_")
-        response_mask = response_mask[self.usersays_index["ids"]]
+        response_mask = response_mask[index["ids"]]
 
-        filtered_data = {"user_emb":self.usersays_index["user_emb"][response_mask*filter_idx],
-                         "ids":self.usersays_index["ids"][response_mask*filter_idx]}
+        filtered_data = {"user_emb":index["user_emb"][response_mask*filter_idx],
+                         "ids":index["ids"][response_mask*filter_idx]}
 
         if len(filtered_data["ids"]) < 1:
             return self.get_fallback(current_status)
@@ -242,6 +353,7 @@ class RuleResponse(SkillBase):
         '''
             Get fallback feedback
         '''
+        metrics.incr("fallback." + self.skill_name)
         if len(self.usersays_index["fallback"]) < 1:
             return None, 0
         return numpy.random.choice(self.usersays_index["fallback"]), 1
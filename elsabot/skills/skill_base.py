@@ -1,6 +1,7 @@
 #!/usr/bin/env python
-import numpy, re
+import numpy, re, torch
 from rapidfuzz import fuzz, process
+from ..module.shared_resources import SharedResources
 
 """
     Author: Pengjia Zhu (zhupengjia@gmail.com)
@@ -11,6 +12,7 @@ class SkillBase:
     """
         Base skill class. Define some necessaryy methods for a skill
     """
+    warmup = True # run by ..module.interact_session.InteractSession.warmup, False for skills without local model
     def __init__(self, skill_name):
         self.skill_name = skill_name
    
@@ -26,6 +28,52 @@ class SkillBase:
         """
         pass
 
+    @staticmethod
+    def load_checkpoint(saved_model, shared_layers=None):
+        """
+            load checkpoint to cpu, reuse the one already loaded by other skills if shared_layers is instance of SharedResources
+
+            Input:
+                - saved_model: path of checkpoint
+                - shared_layers: dictionary, default is None
+        """
+        if isinstance(shared_layers, SharedResources):
+            return shared_layers.checkpoint(saved_model)
+        return torch.load(saved_model, map_location=lambda storage, location: storage)
+
+    def warmup_utterances(self, lengths):
+        """
+            synthetic utterances for warming up before serving, one for each length.
+            Built from user says of dialogflow if the skill has one
+
+            Input:
+                - lengths: list of int, number of words of utterances
+        """
+        words = ["hello", "how", "are", "you", "what", "can", "I", "do", "for", "today"]
+        dialogflow = getattr(self, "dialogflow", None)
+        if dialogflow is not None and getattr(dialogflow, "dialogs", None) is not None:
+            for says in dialogflow.dialogs["user_says"].dropna():
+                if says and says[0].split():
+                    words = says[0].split()
+                    break
+        return [" ".join((words * (n // len(words) + 1))[:n]) for n in lengths]
+
+    def export_state(self):
+        """
+            runtime state changed during serving, e.g. learned user says, saved when the skill is unloaded.
+            Must be picklable, None if nothing to save
+        """
+        return None
+
+    def import_state(self, state):
+        """
+            restore runtime state from export_state after the skill is built again
+
+            Input:
+                - state: returned by export_state
+        """
+        pass
+
     def eval(self):
         """
             set model to eval mode
@@ -52,6 +100,23 @@ class SkillBase:
         """
         return None, 0
 
+    def get_response_batch(self, status_data, status_list, incre_state=None, **args):
+        """
+            predict response values for a batch of status, default is to call get_response one by one
+
+            Input:
+                - status_data: batch data converted from status list, see ..module.dialog_status.status_collate
+                - status_list: list of current_status dictionaries, generated from dialog_status module
+                - incre_state: incremental state, default is None
+
+            Output:
+                - list of (response_value, response_score)
+        """
+        if len(status_list) == 1:
+            return [self.get_response(status_data, status_list[0], incre_state=incre_state, **args)]
+        return [self.get_response(status_data.select([i]), current_status, incre_state={}, **args)
+                for i, current_status in enumerate(status_list)]
+
     def update_response(self, response, current_status):
         """
             update current response to the response status.
@@ -67,7 +132,7 @@ class SkillBase:
         match and replace entity name in text
         """
         upper = regroup.group(1).upper()
-        match process.extractOne(upper, all_entities,
+        match = process.extractOne(upper, all_entities,
             processor=None, scorer=fuzz.partial_ratio, score_cutoff=80)
         if match:
             return "{" + match[0] +"}"
@@ -28,6 +28,9 @@ setup(
     install_requires=required,
     scripts=[
         "elsa_interact.py",
+        "elsa_loadtest.py",
+        "elsa_tune.py",
+        "elsa_bulk.py",
         "elsa_train.py",
         "elsa_train_rl.py"
     ],